@@ -1,5 +1,6 @@
 import collections
 import asyncio
+import io
 
 import voxelbotutils as vbu
 import discord
@@ -11,6 +12,42 @@ from cogs import utils
 
 class BeeCommands(vbu.Cog):
 
+    TREE_MAX_DEPTH = 8  # How many generations back the bee tree goes before collapsing them
+
+    #: The groups that the bee list is split into, and their titles.
+    BEE_LIST_GROUPS = (
+        (utils.Nobility.QUEEN, "Queens",),
+        (utils.Nobility.PRINCESS, "Princesses",),
+        (utils.Nobility.DRONE, "Drones",),
+    )
+
+    def __init__(self, bot: vbu.Bot):
+        super().__init__(bot)
+        render_config = bot.config.get("graphviz", {})
+        self.render_pool = utils.RenderPool(
+            workers=render_config.get("workers", 2),
+            max_queue=render_config.get("queue_size", 20),
+            timeout=render_config.get("timeout", 10),
+        )
+
+    def cog_unload(self):
+        self.render_pool.close()
+
+    async def send_dot(self, ctx: vbu.Context, output: str, filename: str, description: str):
+        """
+        Render the body of a DOT digraph into an image and send it. The description
+        is what the image is called in any error messages (eg "bee map").
+        """
+
+        try:
+            image = await self.render_pool.render(ctx.author.id, f"digraph{{{output}}}\n")
+        except utils.RenderBusy:
+            return await ctx.send(f"I'm drawing a lot of {description}s right now - please try again in a minute.")
+        except utils.RenderError as e:
+            self.logger.error(f"Could not render {filename}", exc_info=e)
+            return await ctx.send(f"I was unable to send your {description} image - please try again later.")
+        return await ctx.send(file=discord.File(io.BytesIO(image), filename=filename))
+
     @vbu.group()
     async def bee(self, ctx: vbu.Context):
         """
@@ -91,12 +128,26 @@ class BeeCommands(vbu.Cog):
         Shows you all of the bees you have.
         """
 
-        # Get the bees for the given user
+        # Count the bees for the given user
         user = user or ctx.author
+        guild_id = utils.get_bee_guild_id(ctx)
         async with self.bot.database() as db:
-            bees = await utils.Bee.fetch_bees_by_user(db, utils.get_bee_guild_id(ctx), user.id)
-        bees = [i for i in bees if i.hive_id is None]
-        if not bees:
+            rows = await db(
+                """
+                SELECT
+                    nobility, type, COUNT(*) AS count
+                FROM
+                    bees
+                WHERE
+                    guild_id = $1
+                    AND owner_id = $2
+                    AND hive_id IS NULL
+                GROUP BY
+                    nobility, type
+                """,
+                guild_id, user.id,
+            )
+        if not rows:
             text = vbu.format(
                 "{0:pronoun,You,{1}} {0:pronoun,don't,doesn't} have any bees! :c",
                 ctx.author == user,
@@ -104,57 +155,103 @@ class BeeCommands(vbu.Cog):
             )
             return await ctx.send(text, wait=False)
 
-        # Collate their bees
-        bee_groups = collections.defaultdict(list)
-        for i in bees:
-            bee_groups[i.nobility].append(i)
-        drone_types = collections.defaultdict(list)
-        for i in bee_groups[utils.Nobility.DRONE]:
-            drone_types[i.type].append(i)
-        drone_types = list(drone_types.items())
-        drone_types.sort(key=lambda item: len(item[1]), reverse=True)
-
-        # Format their bees into an embed
+        # Collate their counts
+        type_counts = collections.defaultdict(list)
+        for row in rows:
+            type_counts[utils.Nobility(row['nobility'])].append((row['type'], row['count'],))
+        for counts in type_counts.values():
+            counts.sort(key=lambda item: (-item[1], item[0],))
+
+        # Format their counts into an embed
         description = vbu.format(
             "{0:pronoun,You,{2}} {0:pronoun,have,has} **{1}** total {1:plural,bee,bees}",
             ctx.author == user,
-            len(bees),
+            sum(i['count'] for i in rows),
             user.mention,
         )
-        embed = vbu.Embed(use_random_colour=True, description=description)
-        formatter = lambda bee: f"\N{BULLET} **{bee.display_name}** ({bee.display_type})"  # noqa
-        embed.add_field(
-            "Queens",
-            "\n".join([formatter(i) for i in bee_groups[utils.Nobility.QUEEN]]) or "None :<",
-            inline=False
-        )
-        embed.add_field(
-            "Princesses",
-            "\n".join([formatter(i) for i in bee_groups[utils.Nobility.PRINCESS]]) or "None :<",
-            inline=False
-        )
-        for t, bees in drone_types:
-            embed.add_field(
-                f"{t.value.title()} Drones",
-                "\n".join([f"\N{BULLET} {i.display_name}" for i in bees]) or "None :<",
-                inline=True
+        summary_embed = vbu.Embed(use_random_colour=True, description=description)
+        for nobility, title in self.BEE_LIST_GROUPS:
+            summary_embed.add_field(
+                title,
+                "\n".join([f"\N{BULLET} **{count}** {bee_type}" for bee_type, count in type_counts[nobility]]) or "None :<",
+                inline=True,
             )
 
         # Make the components to send
-        components = vbu.MessageComponents(vbu.ActionRow(
+        command_row = vbu.ActionRow(
             vbu.Button("Get new bees", custom_id="RUNCOMMAND bee get", style=vbu.ButtonStyle.SECONDARY),
             vbu.Button("Breed some of your bees", custom_id="RUNCOMMAND bee breed", style=vbu.ButtonStyle.SECONDARY),
             vbu.Button("Add one of your queens to a hive", custom_id="RUNCOMMAND hive add", style=vbu.ButtonStyle.SECONDARY),
             vbu.Button("Release some of your bees", custom_id="RUNCOMMAND bee release", style=vbu.ButtonStyle.SECONDARY),
             vbu.Button("See your discovered cross-breeds", custom_id="RUNCOMMAND bee map", style=vbu.ButtonStyle.SECONDARY),
-        ))
-        return await ctx.send(
-            embed=embed,
+        )
+        summary_components = vbu.MessageComponents(
+            vbu.ActionRow(*[
+                vbu.Button(f"See {title.lower()}", custom_id=f"BEE_LIST {nobility.name}", disabled=not type_counts[nobility])
+                for nobility, title in self.BEE_LIST_GROUPS
+            ]),
+            command_row,
+        )
+        message = await ctx.send(
+            embed=summary_embed,
             allowed_mentions=discord.AllowedMentions.none(),
-            components=components,
-            wait=False,
+            components=summary_components,
         )
 
+        # Let them page through the bees in each group - we only fetch a page once it's asked for
+        group = None
+        page_starts = [None]
+        last_page_key = None  # Where the next page starts from, if there is one
+        check = vbu.component_check(ctx.author, message)
+        while True:
+            try:
+                payload = await self.bot.wait_for(
+                    "component_interaction",
+                    check=lambda p: check(p) and p.component.custom_id.startswith("BEE_LIST"),
+                    timeout=120,
+                )
+            except asyncio.TimeoutError:
+                return await message.edit(components=vbu.MessageComponents(command_row))
+
+            # See what they want to look at
+            action = payload.component.custom_id.split(" ")[1]
+            if action == "BACK":
+                await payload.update_message(embed=summary_embed, components=summary_components)
+                continue
+            elif action == "NEXT":
+                if last_page_key is None:
+                    continue
+                page_starts.append(last_page_key)
+            elif action == "PREVIOUS":
+                page_starts.pop()
+            else:
+                group = utils.Nobility[action]
+                page_starts = [None]
+
+            # Grab the page, with an extra bee to see if there's a next one
+            condition, args = utils.Bee.get_filter_condition(guild_id, user.id, nobility=group, in_hive=False)
+            async with self.bot.database() as db:
+                bees = await utils.Bee.fetch_bee_page(db, condition, *args, after=page_starts[-1], limit=26)
+            has_next_page = len(bees) > 25
+            bees = bees[:25]
+            last_page_key = (bees[-1].display_name, bees[-1].id,) if has_next_page else None
+
+            # And show it
+            title = dict(self.BEE_LIST_GROUPS)[group]
+            embed = vbu.Embed(
+                use_random_colour=True,
+                title=f"{title} (page {len(page_starts)})",
+                description="\n".join([f"\N{BULLET} **{i.display_name}** ({i.type.value})" for i in bees]) or "None :<",
+            )
+            await payload.update_message(embed=embed, components=vbu.MessageComponents(
+                vbu.ActionRow(
+                    vbu.Button("Previous", custom_id="BEE_LIST PREVIOUS", disabled=len(page_starts) == 1),
+                    vbu.Button("Next", custom_id="BEE_LIST NEXT", disabled=not has_next_page or not bees),
+                    vbu.Button("Back", custom_id="BEE_LIST BACK", style=vbu.ButtonStyle.SECONDARY),
+                ),
+                command_row,
+            ))
+
     @bee.command(name="rename")
     @vbu.defer()
     async def bee_rename(self, ctx: vbu.Context, before: utils.Bee = None, *, after: str = None):
@@ -228,6 +325,7 @@ class BeeCommands(vbu.Cog):
                 """UPDATE bees SET owner_id = NULL WHERE id = ANY($1::TEXT[])""",
                 bee_ids,
             )
+        utils.user_cache.invalidate(utils.get_bee_guild_id(ctx), ctx.author.id)
         return await send_method(
             content=vbu.format("Released **{0}** {0:plural,bee,bees} into the wild \N{PENSIVE FACE}", len(bee_ids)),
             components=None,
@@ -260,7 +358,7 @@ class BeeCommands(vbu.Cog):
         # Get the princess
         payload, current_message, bees = await utils.Bee.send_bee_dropdown(
             ctx=ctx, send_method=send_method, current_message=None, group_by_nobility=True,
-            group_by_type=True, check=lambda bee: bee.nobility == utils.Nobility.PRINCESS,
+            group_by_type=True, nobility=utils.Nobility.PRINCESS,
             content="Which princess would you like to breed?",
         )
         if not bees:
@@ -271,7 +369,7 @@ class BeeCommands(vbu.Cog):
         # Get the drone
         payload, current_message, bees = await utils.Bee.send_bee_dropdown(
             ctx=ctx, send_method=send_method, current_message=current_message, group_by_nobility=True,
-            group_by_type=True, check=lambda bee: bee.nobility == utils.Nobility.DRONE,
+            group_by_type=True, nobility=utils.Nobility.DRONE,
             content="Which drone would you like to breed?",
         )
         if not bees:
@@ -310,6 +408,73 @@ class BeeCommands(vbu.Cog):
             allowed_mentions=discord.AllowedMentions.none(),
         )
 
+    @bee.command(name="plan")
+    @vbu.defer()
+    async def bee_plan(self, ctx: vbu.Context, *, bee_type: str):
+        """
+        Work out how you can breed a given type of bee from the princesses and drones
+        that you have.
+        """
+
+        # See what they're trying to get to
+        target = utils.BeeType.get(bee_type.replace(" ", "_"))
+        if target is None:
+            return await ctx.send(
+                f"I don't know of any bee type called **{bee_type}** :<",
+                allowed_mentions=discord.AllowedMentions.none(),
+                wait=False,
+            )
+
+        # Get the types of the bees that they could breed with - a cross needs a princess
+        # and a drone, so we keep track of those separately
+        async with self.bot.database() as db:
+            bees = await utils.Bee.fetch_bees_by_user(db, utils.get_bee_guild_id(ctx), ctx.author.id)
+        if [i for i in bees if i.type == target]:
+            return await ctx.send(f"You already have a {target.value} bee! :D", wait=False)
+        unhived_bees = [i for i in bees if i.hive_id is None]
+        princess_types = {i.type for i in unhived_bees if i.nobility == utils.Nobility.PRINCESS}
+        drone_types = {i.type for i in unhived_bees if i.nobility == utils.Nobility.DRONE}
+
+        # Work out a plan
+        plan = utils.BeeType.BREEDING_GRAPH.get_plan(princess_types, drone_types, target)
+        if plan is None:
+            return await ctx.send(f"There's no way to breed a {target.value} bee :<", wait=False)
+
+        # And respond
+        lines = []
+        for index, step in enumerate(plan.steps, start=1):
+            if step.is_catch:
+                line = f"Catch a **{step.result.value}** {'princess' if step.princess else 'drone'}"
+            else:
+                line = (
+                    f"Breed a **{step.left.value}** princess with a **{step.right.value}** drone "
+                    f"into a **{step.result.value}** queen"
+                )
+            if step.chance < 1:
+                line += f" ({step.chance:.0%} chance)"
+            lines.append(f"{index}. {line}")
+        lines.append("")
+        lines.append(
+            "Only your princesses and drones that aren't in a hive are counted. Each queen that "
+            "you breed needs to live out her life in a hive to leave the princess and drones "
+            "for the steps after her, and each bee can only be bred once - so you may need "
+            "more than one bee of a type."
+        )
+        embed = vbu.Embed(
+            use_random_colour=True,
+            title=f"How to get a {target.value} bee",
+            description="\n".join(lines),
+        )
+        embed.set_footer(text=f"Overall chance: {plan.chance:.2%}")
+        return await ctx.send(
+            embed=embed,
+            components=vbu.MessageComponents(vbu.ActionRow(
+                vbu.Button("Get new bees", custom_id="RUNCOMMAND bee get", style=vbu.ButtonStyle.SECONDARY),
+                vbu.Button("Breed your bees", custom_id="RUNCOMMAND bee breed", style=vbu.ButtonStyle.SECONDARY),
+            )),
+            wait=False,
+        )
+
     @bee.command(name="map")
     @vbu.defer()
     async def bee_map(self, ctx: vbu.Context):
@@ -439,42 +604,8 @@ class BeeCommands(vbu.Cog):
         if len(output) <= 2:
             return await ctx.send("You've not cross-bred any bees yet :<")
 
-        # Write the dot to a file
-        dot_filename = f'./.{ctx.author.id}.dot'
-        try:
-            output_string = "".join(output)
-            with open(dot_filename, 'w', encoding='utf-8') as a:
-                a.write(f"digraph{{{output_string}}}\n")
-        except Exception as e:
-            self.logger.error(f"Could not write to {dot_filename}")
-            raise e
-
-        # Convert to an image
-        image_filename = f'./.{ctx.author.id}.png'
-        format_rendering_option = '-Tpng:cairo'
-        dot = await asyncio.create_subprocess_exec('dot', format_rendering_option, dot_filename, '-o', image_filename, '-Gcharset=UTF-8')
-        # dot = await asyncio.create_subprocess_exec('neato', format_rendering_option, dot_filename, '-o', image_filename, '-Gcharset=UTF-8')
-        await asyncio.wait_for(dot.wait(), 10.0)
-
-        # Kill subprocess
-        try:
-            dot.kill()
-        except ProcessLookupError:
-            pass  # It already died
-        except Exception:
-            raise
-
-        # Send file
-        try:
-            file = discord.File(image_filename)
-        except FileNotFoundError:
-            return await ctx.send("I was unable to send your bee map image - please try again later.")
-        await ctx.send(file=file)
-        await asyncio.sleep(1)
-
-        # Delete the files
-        self.bot.loop.create_task(asyncio.create_subprocess_exec('rm', dot_filename))
-        self.bot.loop.create_task(asyncio.create_subprocess_exec('rm', image_filename))
+        # Render and send it
+        return await self.send_dot(ctx, "".join(output), "map.png", "bee map")
 
     @bee.command(name="tree")
     @vbu.defer()
@@ -499,20 +630,9 @@ class BeeCommands(vbu.Cog):
             if payload:
                 send_method = payload.update_message
 
-        # Grab all the bees that have ever been in that bee's family
-        bee_parent_ids = bee.parent_ids
-        bees = {bee.id: bee}
+        # Grab the bee's family, as far back as we're willing to draw
         async with self.bot.database() as db:
-            while bee_parent_ids:
-                rows = await db(
-                    """SELECT * FROM bees WHERE guild_id = $1 AND id = ANY($2::TEXT[])""",
-                    utils.get_bee_guild_id(ctx), bee_parent_ids,
-                )
-                new_bees = {i['id']: utils.Bee(**i) for i in rows}
-                bee_parent_ids = []
-                for b in new_bees.values():
-                    bee_parent_ids.extend(b.parent_ids)
-                bees.update(new_bees)
+            ancestry = await bee.fetch_ancestry(db, self.TREE_MAX_DEPTH)
 
         # Generate our starting DOT lines
         output = []
@@ -523,55 +643,44 @@ class BeeCommands(vbu.Cog):
             "node[color=transparent,margin=0.03,shape=box,height=0.001,width=0.001];"
         ))
 
-        # And add our bee friends
-        for bee in bees.values():
-            bee_name = bee.display_name.replace('"', '\\"')
-            output.append((
-                f"BEE_{bee.id.replace('-', '_')}[label=\"{bee_name}\\n({bee.display_type})\"];"
-            ))
-            for parent_id in bee.parent_ids:
-                parent = bees[parent_id]
-                bee_name = parent.display_name.replace('"', '\\"')
-                output.append((
-                    f"BEE_{parent.id.replace('-', '_')}[label=\"{bee_name} ({parent.display_type})\"];"
-                    f"BEE_{parent.id.replace('-', '_')}->BEE_{bee.id.replace('-', '_')};"
-                ))
-
-        # Write the dot to a file
-        dot_filename = f'./.{ctx.author.id}.dot'
-        try:
-            output_string = "".join(output)
-            with open(dot_filename, 'w', encoding='utf-8') as a:
-                a.write(f"digraph{{{output_string}}}\n")
-        except Exception as e:
-            self.logger.error(f"Could not write to {dot_filename}")
-            raise e
-
-        # Convert to an image
-        image_filename = f'./.{ctx.author.id}.png'
-        format_rendering_option = '-Tpng:cairo'
-        dot = await asyncio.create_subprocess_exec('dot', format_rendering_option, dot_filename, '-o', image_filename, '-Gcharset=UTF-8')
-        await asyncio.wait_for(dot.wait(), 10.0)
-
-        # Kill subprocess
-        try:
-            dot.kill()
-        except ProcessLookupError:
-            pass  # It already died
-        except Exception:
-            raise
+        # Add each of the bees once, with an edge from each of their parents; anything
+        # further back than we fetched is collapsed into a single node
+        older_generations = False
+        for ancestor, depth in ancestry.values():
+            ancestor_name = ancestor.display_name.replace('"', '\\"')
+            node = f"BEE_{ancestor.id.replace('-', '_')}"
+            output.append(f"{node}[label=\"{ancestor_name}\\n({ancestor.display_type})\"];")
+            has_older_parents = False  # So that we only add one edge from the older generations
+            for parent_id in set(ancestor.parent_ids or ()):
+                if parent_id in ancestry:
+                    output.append(f"BEE_{parent_id.replace('-', '_')}->{node};")
+                elif depth >= self.TREE_MAX_DEPTH and not has_older_parents:
+                    output.append(f"OLDER_GENERATIONS->{node};")
+                    older_generations = True
+                    has_older_parents = True
+        if older_generations:
+            output.append("OLDER_GENERATIONS[label=\"Older generations\",style=dashed,color=grey];")
+
+        # Render and send it
+        return await self.send_dot(ctx, "".join(output), "tree.png", "bee tree")
+
+    @bee.command(name="renderstats")
+    @commands.is_owner()
+    async def bee_render_stats(self, ctx: vbu.Context):
+        """
+        Show how the bee map renderer is keeping up.
+        """
 
-        # Send file
-        try:
-            file = discord.File(image_filename)
-        except FileNotFoundError:
-            return await ctx.send("I was unable to send your bee map image - please try again later.")
-        await ctx.send(file=file)
-        await asyncio.sleep(1)
-
-        # Delete the files
-        self.bot.loop.create_task(asyncio.create_subprocess_exec('rm', dot_filename))
-        self.bot.loop.create_task(asyncio.create_subprocess_exec('rm', image_filename))
+        pool = self.render_pool
+        return await ctx.send(
+            (
+                f"**Workers**: {len(pool.workers)}/{pool.worker_count}\n"
+                f"**Queue**: {pool.queue_depth}/{pool.max_queue} (peak {pool.max_queue_depth})\n"
+                f"**Rendered**: {pool.rendered}, **failed**: {pool.failed}, **rejected**: {pool.rejected}, **deduplicated**: {pool.deduplicated}\n"
+                f"**Average wait**: {pool.average_wait_time:.2f}s, **average render**: {pool.average_render_time:.2f}s"
+            ),
+            wait=False,
+        )
 
 
 def setup(bot: vbu.Bot):
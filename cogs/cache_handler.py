@@ -0,0 +1,75 @@
+import asyncio
+
+import asyncpg
+import voxelbotutils as vbu
+from discord.ext import commands
+
+from cogs import utils
+
+
+class CacheHandler(vbu.Cog):
+
+    RECONNECT_INTERVAL = 5  # How often to check that we're still listening for changes, in seconds
+
+    def __init__(self, bot: vbu.Bot):
+        super().__init__(bot)
+        cache_config = bot.config.get("user_cache", {})
+        utils.user_cache.configure(
+            max_size=cache_config.get("cache_size", 5_000),
+            ttl=cache_config.get("ttl", 300),
+        )
+        self.listener = None
+        self.listener_task = bot.loop.create_task(self.listen_for_changes())
+
+    def cog_unload(self):
+        self.listener_task.cancel()
+        if self.listener is not None:
+            self.bot.loop.create_task(self.listener.close())
+
+    async def listen_for_changes(self):
+        """
+        Listen for the database telling us that something a user owns has changed, so
+        that we can drop what we have cached for them. If we lose the connection then
+        we could have missed some changes, so the whole cache is cleared.
+        """
+
+        while True:
+            if self.listener is None or self.listener.is_closed():
+                utils.user_cache.clear()
+                try:
+                    config = self.bot.config["database"].copy()
+                    config.pop("enabled", None)
+                    self.listener = await asyncpg.connect(**config)
+                    await self.listener.add_listener("owner_changes", utils.user_cache.handle_owner_change)
+                except Exception as e:
+                    self.logger.error("Could not listen for owner changes", exc_info=e)
+                    self.listener = None
+            await asyncio.sleep(self.RECONNECT_INTERVAL)
+
+    @vbu.command(name="cachestats")
+    @commands.is_owner()
+    async def cache_stats(self, ctx: vbu.Context):
+        """
+        Show how well the user cache is doing.
+        """
+
+        cache = utils.user_cache
+        lines = [
+            f"**Cached users**: {len(cache.bees)} with bees, {len(cache.hives)} with hives (max {cache.bees.max_size})",
+            f"**Bees**: {cache.bees.hits} hits, {cache.bees.misses} misses ({cache.bees.hit_rate:.1%} hit rate)",
+            f"**Hives**: {cache.hives.hits} hits, {cache.hives.misses} misses ({cache.hives.hit_rate:.1%} hit rate)",
+            f"**Invalidations**: {cache.invalidations}",
+            "",
+        ]
+        for name, loader in (("Bees by ID", utils.Bee.id_loader), ("Bees by user", utils.Bee.user_loader), ("Hives by user", utils.Hive.user_loader)):
+            lines.append(f"**{name} loader**: {loader.loads} loads in {loader.batches} batches ({loader.coalesced} coalesced)")
+        lines += [
+            f"**Listening for changes**: {'yes' if self.listener is not None and not self.listener.is_closed() else 'no'}",
+        ]
+        embed = vbu.Embed(use_random_colour=True, title="Cache stats", description="\n".join(lines))
+        return await ctx.send(embed=embed, wait=False)
+
+
+def setup(bot: vbu.Bot):
+    x = CacheHandler(bot)
+    bot.add_cog(x)
@@ -3,6 +3,7 @@ import enum
 
 import voxelbotutils as vbu
 import discord
+from discord.ext import commands, tasks
 
 from cogs import utils
 
@@ -12,110 +13,29 @@ HiveShow = enum.Enum("HiveInclude", "all bees items")
 
 class HiveCommands(vbu.Cog):
 
-    @vbu.Cog.listener("on_bee_tick")
-    async def hive_lifetime_ticker(self):
+    def __init__(self, bot: vbu.Bot):
+        super().__init__(bot)
+        grid_config = bot.config.get("hive_grids", {})
+        utils.Hive.grid_cache.max_size = grid_config.get("cache_size", utils.Hive.grid_cache.max_size)
+        self.grid_cache_file = grid_config.get("cache_file") or None
+        if self.grid_cache_file:
+            utils.Hive.load_grid_cache(self.grid_cache_file)
+            self.grid_cache_saver.start()
+
+    def cog_unload(self):
+        if self.grid_cache_file:
+            self.grid_cache_saver.cancel()
+            utils.Hive.save_grid_cache(self.grid_cache_file)
+
+    @tasks.loop(minutes=5)
+    async def grid_cache_saver(self):
         """
-        Update the bees' lived lifetime every tick.
+        Save the cached hive grids every so often.
         """
 
-        # Open the database
-        async with self.bot.database() as db:
-
-            # Update bee lifetimes
-            await db(
-                """
-                UPDATE
-                    bees
-                SET
-                    lived_lifetime = lived_lifetime + 1
-                WHERE
-                    hive_id IS NOT NULL -- is in a hive
-                    AND nobility = 'Queen'  -- is a queen
-                    AND lived_lifetime < lifetime  -- hasn't lived its life
-                """,
-            )
-
-            # Add some honey combs
-            comb_rows = await db(
-                """
-                SELECT
-                    hive_id,
-                    type,
-                    FLOOR(RANDOM() * (FLOOR(CAST(bees.speed AS REAL) / 100) + 1) + 1) quantity
-                FROM
-                    bees
-                WHERE
-                    hive_id IS NOT NULL
-                    AND nobility = 'Queen'
-                    AND lived_lifetime < lifetime
-                    AND RANDOM() * 100 <= speed
-                """
-            )
-            comb_adds = [
-                (row['hive_id'], utils.BeeType.get(row['type']).get_comb(), row['quantity'],)
-                for row in comb_rows
-            ]
-            await db.execute_many(
-                """
-                INSERT INTO
-                    hive_inventory
-                    (hive_id, item_name, quantity)
-                VALUES
-                    ($1, INITCAP($2 || ' Comb'), $3)
-                ON CONFLICT
-                    (hive_id, item_name)
-                DO UPDATE SET
-                    quantity = hive_inventory.quantity + excluded.quantity
-                """,
-                *comb_adds,
-            )
-
-            # See which of the bees are dead
-            dead_queen_rows = await db(
-                """
-                SELECT
-                    *
-                FROM
-                    bees
-                WHERE
-                    hive_id IS NOT NULL
-                    AND nobility = 'Queen'
-                    AND lived_lifetime >= lifetime
-                """
-            )
-
-            # And handle those heckos
-            dead_queen_list = [utils.Bee(**i) for i in dead_queen_rows]
-            dead_queens = {i.hive_id: i for i in dead_queen_list}
-            queen_death_tasks = [i.die(db) for i in dead_queens.values()]
-            new_bees = await asyncio.gather(*queen_death_tasks)
-
-            # Get the owner IDs for every bee that's died
-            results = []
-            for i in new_bees:
-                try:
-                    results.extend(i)
-                except Exception as e:
-                    self.logger.error(e, exc_info=e)
-            all_owner_ids = {i.hive_id: i.owner_id for i in results}
-
-            # DM authors who want to know when the bees die
-            for hive_id, owner_id in all_owner_ids.items():
-                hive = await utils.Hive.fetch_hive_by_id(db, hive_id)
-                try:
-                    owner = self.bot.get_user(owner_id) or await self.bot.fetch_user(owner_id)
-                    try:
-                        text = f"**{dead_queens[hive.id].display_name}** in hive **{hive.name}** has perished :<"
-                    except KeyError:
-                        text = f"Your queen in hive **{hive.name}** has perished :<"
-                    await owner.send(
-                        content=text,
-                        components=vbu.MessageComponents(vbu.ActionRow(
-                            vbu.Button("See your hives", custom_id="RUNCOMMAND hive list", style=vbu.ButtonStyle.SECONDARY),
-                        )),
-                    )
-                except discord.HTTPException:
-                    pass
+        items = utils.Hive.grid_cache.items()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, utils.Hive.save_grid_cache, self.grid_cache_file, items)
 
     @vbu.group(invoke_without_command=False)
     async def hive(self, ctx: vbu.Context):
@@ -170,6 +90,7 @@ class HiveCommands(vbu.Cog):
                         bee_field_value += f"\n\N{BULLET} {i.name} ({i.display_type})"
 
             # If the hive has an inventory
+            h.add_unsaved_inventory()
             if h.inventory:
                 for i in h.inventory.values():
                     if i.quantity > 0:
@@ -220,7 +141,7 @@ class HiveCommands(vbu.Cog):
         if bee is None:
             payload, dropdown_message, bee = await utils.Bee.send_bee_dropdown(
                 ctx=ctx, send_method=send_method, current_message=dropdown_message,
-                group_by_type=True, check=lambda bee: bee.nobility == utils.Nobility.QUEEN,
+                group_by_type=True, nobility=utils.Nobility.QUEEN, in_hive=False,
             )
             if not bee:
                 return
@@ -322,7 +243,11 @@ class HiveCommands(vbu.Cog):
         bee_count = len(hive.bees)
         async with ctx.typing():
             async with self.bot.database() as db:
-                await db("""UPDATE bees SET hive_id = NULL WHERE hive_id = $1""", hive.id)
+                await db(
+                    """UPDATE bees SET hive_id = NULL, hive_entered_at = NULL, hive_expires_at = NULL
+                    WHERE hive_id = $1""",
+                    hive.id,
+                )
                 await db.start_transaction()
                 await db(
                     """
@@ -342,8 +267,16 @@ class HiveCommands(vbu.Cog):
                     utils.get_bee_guild_id(ctx), ctx.author.id, hive.id,
                 )
                 await db("""UPDATE hive_inventory SET quantity = 0 WHERE hive_id = $1""", hive.id)
+                await db("""SELECT PG_NOTIFY('hive_inventory_clears', $1)""", hive.id)
                 await db.commit_transaction()
 
+        # Throw away any combs that haven't been saved to the hive yet, so that they don't
+        # turn up in it after it's been emptied - we do that here if the ticks are running
+        # in this process, and whichever process is running them does it on the notify
+        if utils.hive_inventory_buffer.live:
+            utils.hive_inventory_buffer.discard_hive(hive.id)
+        utils.user_cache.invalidate(utils.get_bee_guild_id(ctx), ctx.author.id)
+
         # And done
         item_names = []
         if bee_count:
@@ -361,6 +294,23 @@ class HiveCommands(vbu.Cog):
             )),
         )
 
+    @hive.command(name="gridstats")
+    @commands.is_owner()
+    async def hive_grid_stats(self, ctx: vbu.Context):
+        """
+        Show how well the hive grid cache is doing.
+        """
+
+        cache = utils.Hive.grid_cache
+        return await ctx.send(
+            (
+                f"**Cached grids**: {len(cache)}/{cache.max_size}\n"
+                f"**Hits**: {cache.hits}, **misses**: {cache.misses} ({cache.hit_rate:.1%} hit rate)\n"
+                f"**Saved to**: {self.grid_cache_file or 'nowhere'}"
+            ),
+            wait=False,
+        )
+
 
 def setup(bot: vbu.Bot):
     x = HiveCommands(bot)
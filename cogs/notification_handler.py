@@ -0,0 +1,134 @@
+import asyncio
+import collections
+import time
+import typing
+
+import voxelbotutils as vbu
+import discord
+from discord.ext import tasks
+
+from cogs import utils
+
+
+class NotificationHandler(vbu.Cog):
+
+    MAX_NOTIFICATIONS_PER_RUN = 200  # How many notifications to pull out of the outbox at once
+    DM_INTERVAL = 0.25  # How long to wait between sending each DM, in seconds
+
+    def __init__(self, bot: vbu.Bot):
+        super().__init__(bot)
+        self.dm_channels = utils.LRUCache(max_size=5_000)
+        self.death_notification_sender.start()
+
+    def cog_unload(self):
+        self.death_notification_sender.stop()
+
+    async def get_dm_channel(self, user_id: int) -> discord.DMChannel:
+        """
+        Get the DM channel for a given user, caching it so we only need to hit
+        the API once per user.
+        """
+
+        channel = self.dm_channels.get(user_id)
+        if channel is None:
+            user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+            channel = user.dm_channel or await user.create_dm()
+            self.dm_channels.set(user_id, channel)
+        return channel
+
+    @tasks.loop(seconds=2)
+    async def death_notification_sender(self):
+        """
+        Tell users when their queens die. Anything going wrong is logged rather than
+        raised, so that the loop carries on and tries again on its next run.
+        """
+
+        try:
+            await self.send_death_notifications()
+        except Exception as e:
+            self.logger.error("Error sending death notifications", exc_info=e)
+
+    async def send_death_notifications(self):
+        """
+        Send out a batch of notifications from the outbox. They're only deleted once
+        they've all been sent, so if anything goes wrong partway through then the batch
+        is sent again on the next run - a user could be told twice, but never not told.
+        """
+
+        # Take a batch of notifications out of the outbox, holding onto them so that no
+        # other process sends them while we are
+        start = time.perf_counter()
+        async with self.bot.database() as db:
+            await db.start_transaction()
+            rows = await db(
+                """
+                DELETE FROM
+                    death_notifications
+                WHERE
+                    id IN (
+                        SELECT
+                            id
+                        FROM
+                            death_notifications
+                        ORDER BY
+                            id
+                        LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                RETURNING
+                    *
+                """,
+                self.MAX_NOTIFICATIONS_PER_RUN,
+            )
+            if not rows:
+                await db.commit_transaction()
+                return
+            hive_rows = await db(
+                """SELECT * FROM hives WHERE id = ANY($1::TEXT[])""",
+                list({i['hive_id'] for i in rows}),
+            )
+            hives = {i['id']: utils.Hive(**i) for i in hive_rows}
+
+            # Group the deaths by user so that each person gets one message
+            user_deaths: typing.Dict[int, typing.List[str]] = collections.defaultdict(list)
+            for row in sorted(rows, key=lambda row: row['id']):
+                hive = hives.get(row['hive_id'])
+                hive_name = hive.name if hive else "one of your hives"
+                if row['queen_name']:
+                    user_deaths[row['user_id']].append(f"**{row['queen_name']}** in hive **{hive_name}**")
+                else:
+                    user_deaths[row['user_id']].append(f"Your queen in hive **{hive_name}**")
+
+            # And send them out - the delete is only committed once we're done, and is
+            # rolled back when the connection goes back to the pool if we don't get there
+            for user_id, deaths in user_deaths.items():
+                if len(deaths) == 1:
+                    text = f"{deaths[0]} has perished :<"
+                else:
+                    text = "Some of your queens have perished :<\n" + "\n".join([f"\N{BULLET} {i}" for i in deaths])
+                try:
+                    channel = await self.get_dm_channel(user_id)
+                    await channel.send(
+                        content=text,
+                        components=vbu.MessageComponents(vbu.ActionRow(
+                            vbu.Button("See your hives", custom_id="RUNCOMMAND hive list", style=vbu.ButtonStyle.SECONDARY),
+                        )),
+                    )
+                except discord.HTTPException:
+                    pass
+                await asyncio.sleep(self.DM_INTERVAL)
+            await db.commit_transaction()
+
+        # Let the tick handler know how long that took
+        tick_handler = self.bot.get_cog("TickHandler")
+        if tick_handler:
+            tick_handler.stats.record("notifications", time.perf_counter() - start)
+
+    @death_notification_sender.before_loop
+    async def before_death_notification_sender(self):
+        await self.bot.wait_until_ready()
+
+
+def setup(bot: vbu.Bot):
+    x = NotificationHandler(bot)
+    bot.add_cog(x)
@@ -1,23 +1,180 @@
+import asyncio
+import datetime as dt
+import time
+
 import voxelbotutils as vbu
-from discord.ext import tasks
+from discord.ext import commands
+
+from cogs import utils
 
 
 class TickHandler(vbu.Cog):
 
+    TICK_LOCK_ID = 0x42454556  # The advisory lock that the tick leader holds, if one isn't set in the config
+
     def __init__(self, bot: vbu.Bot):
         super().__init__(bot)
-        self.ticker.start()
+        tick_config = bot.config.get("ticks", {})
+        self.tick_interval = tick_config.get("interval", utils.TICK_LENGTH.total_seconds())
+        self.workers = tick_config.get("workers", 0)
+        self.engine = None
+        self.stats = utils.TickStats()
+        self.leader = utils.TickLeader(
+            bot.config["database"],
+            lock_id=tick_config.get("lock_id", self.TICK_LOCK_ID),
+            lease=tick_config.get("lease", 20),
+            tick_interval=self.tick_interval,
+            logger=self.logger,
+        )
+        self.leader_task = bot.loop.create_task(self.leader.run())
+        self.ticker_task = bot.loop.create_task(self.ticker())
 
     def cog_unload(self):
-        self.ticker.stop()
+        self.ticker_task.cancel()
+        self.leader_task.cancel()
+        self.bot.loop.create_task(self.close_engine())
+
+    def create_engine(self):
+        """
+        Make a tick engine - either in this process or split over some workers,
+        depending on the config.
+        """
+
+        if self.workers:
+            return utils.TickWorkerPool(
+                self.bot.config["database"], self.workers,
+                leader_name=self.leader.name, lease=self.leader.lease,
+            )
+        return utils.TickEngine(
+            self.bot.database, leader_name=self.leader.name, lease=self.leader.lease,
+            listen_config=self.bot.config["database"],
+        )
+
+    async def close_engine(self):
+        """
+        Save anything that the tick engine has buffered, shut it down, and hand the
+        ticks over to another process.
+        """
+
+        try:
+            if self.engine is not None:
+                if self.leader.is_leader:
+                    await self.engine.save()
+                await self.engine.close()
+        finally:
+            await self.leader.close()
 
-    @tasks.loop(seconds=5)  # 1 tick is 5 seconds
     async def ticker(self):
-        self.bot.dispatch("bee_tick")
+        """
+        Run the tick engine while this process is the tick leader, handing over to
+        whichever process takes over if we stop being.
+        """
 
-    @ticker.before_loop
-    async def before_ticker(self):
         await self.bot.wait_until_ready()
+        while True:
+
+            # Wait until it's our turn, and work out when all of the queens in hives are
+            # going to make combs and die
+            await self.leader.wait_until_leader()
+            self.engine = self.create_engine()
+            try:
+                await self.engine.load()
+                await self.run_ticks()
+            except Exception as e:
+                self.logger.error("Error running the tick engine", exc_info=e)
+                await asyncio.sleep(self.tick_interval)
+
+            # Whoever runs the ticks next will pick up from the last tick that was
+            # saved, so we can throw away anything that we haven't
+            await self.engine.discard()
+            self.engine = None
+
+    async def run_ticks(self):
+        """
+        Run the tick engine every interval for as long as we're the leader. Ticks are
+        run one at a time - if one overruns then we skip the runs that it overlapped
+        with, and the next one catches up on the ticks that were missed.
+        """
+
+        loop = asyncio.get_event_loop()
+        next_run = loop.time()
+        while self.leader.is_leader:
+            start = time.perf_counter()
+            result = None
+            try:
+                result = await self.engine.run()
+            except Exception as e:
+                self.logger.error("Error running tick", exc_info=e)
+            else:
+                self.stats.runs += 1
+                self.stats.last_tick = result["tick"]
+                for phase, seconds in result["timings"].items():
+                    self.stats.record(phase, seconds)
+            elapsed = time.perf_counter() - start
+            self.stats.record("total", elapsed)
+
+            # See if we overran our budget
+            if elapsed > self.tick_interval:
+                self.stats.overruns += 1
+                timings = result["timings"] if result else {}
+                slowest = max(timings.items(), key=lambda item: item[1], default=("unknown", 0))
+                self.logger.warning(
+                    f"Tick took {elapsed:.2f}s, over its budget of {self.tick_interval}s; "
+                    f"the slowest phase was {slowest[0]} ({slowest[1]:.2f}s)"
+                )
+
+            # Wait for the next run, skipping any that we've already missed
+            next_run += self.tick_interval
+            now = loop.time()
+            if now > next_run:
+                missed = int((now - next_run) // self.tick_interval) + 1
+                self.stats.skipped += missed
+                next_run += missed * self.tick_interval
+            await asyncio.sleep(next_run - now)
+
+    @vbu.command(name="tickstats")
+    @commands.is_owner()
+    async def tick_stats(self, ctx: vbu.Context):
+        """
+        Show how long the ticks have been taking.
+        """
+
+        # See who's running the ticks
+        async with self.bot.database() as db:
+            leader_rows = await db("""SELECT * FROM tick_leader""")
+        if leader_rows:
+            leader = leader_rows[0]
+            now = dt.datetime.utcnow()
+            leader_text = (
+                f"{leader['process_name']} (elected {(now - leader['elected_at']).total_seconds():.0f}s ago, "
+                f"renewed {(now - leader['renewed_at']).total_seconds():.1f}s ago)"
+            )
+        else:
+            leader_text = "nobody"
+
+        # And how the ticks have been going
+        lines = [
+            f"**Leader**: {leader_text}",
+            f"**This process**: {self.leader.name} ({'leader' if self.leader.is_leader else 'standby'})",
+            f"**Elections**: {self.leader.elections}, **demotions**: {self.leader.demotions}, **lock errors**: {self.leader.renewal_failures}",
+            f"**Last tick**: {self.stats.last_tick}",
+            f"**Runs**: {self.stats.runs}",
+            f"**Overruns**: {self.stats.overruns} (budget {self.tick_interval}s)",
+            f"**Skipped**: {self.stats.skipped}",
+            "",
+        ]
+        for phase in (*utils.TickEngine.PHASES, "total", "notifications"):
+            percentiles = [self.stats.get_percentile(phase, i) for i in (50, 90, 99, 100)]
+            if percentiles[0] is None:
+                continue
+            lines.append(
+                f"**{phase.capitalize()}**: " + ", ".join([
+                    f"p{p} {t * 1_000:.1f}ms"
+                    for p, t in zip((50, 90, 99, 100), percentiles)
+                ])
+            )
+        embed = vbu.Embed(use_random_colour=True, title="Tick stats", description="\n".join(lines))
+        return await ctx.send(embed=embed, wait=False)
 
 
 def setup(bot: vbu.Bot):
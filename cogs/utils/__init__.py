@@ -1,9 +1,20 @@
 import voxelbotutils as _vbu
 
 from .bee import Bee, BeeType, Nobility  # noqa
+from .breeding_graph import BreedingGraph, BreedingPlan, BreedingStep  # noqa
 from .hive import Hive  # noqa
 from .item import Item, Inventory  # noqa
 from .hive_cell_emoji import HiveCellEmoji  # noqa
+from .timer_wheel import TimerWheel  # noqa
+from .lru_cache import LRUCache  # noqa
+from .data_loader import DataLoader  # noqa
+from .name_index import NameIndex  # noqa
+from .dot_renderer import RenderError, RenderBusy, RenderPool, render_dot  # noqa
+from .user_cache import UserCache, user_cache  # noqa
+from .inventory_buffer import InventoryBuffer, hive_inventory_buffer  # noqa
+from .tick_engine import TickEngine, TickStats  # noqa
+from .tick_worker import TickWorkerPool  # noqa
+from .tick_leader import TickLeader  # noqa
 from .utils import *  # noqa
 
 
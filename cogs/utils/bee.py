@@ -1,8 +1,11 @@
 import typing
 import enum
+import collections
+import uuid
 import random
 import math
 import asyncio
+import datetime as dt
 
 import asyncpg
 import discord
@@ -10,7 +13,13 @@ from discord.ext import commands
 import voxelbotutils as vbu
 
 from .name_utils import get_random_name
-from .utils import get_bee_guild_id
+from .inventory_buffer import InventoryBuffer, hive_inventory_buffer
+from .user_cache import user_cache
+from .data_loader import DataLoader
+from .name_index import NameIndex
+from .timer_wheel import TimerWheel
+from .breeding_graph import BreedingGraph
+from .utils import get_bee_guild_id, get_tick, get_binomial, in_transaction, parse_json_timestamp, TICK_LENGTH
 
 
 class Nobility(enum.Enum):
@@ -24,10 +33,26 @@ class BeeType(object):
     BEE_COMBINATIONS = {}
     BEE_TYPE_VALUES = {}
     BEE_TYPE_COMBS = {}
+    BEE_COMB_VALUES = {}
+
+    #: Every bee type, indexed by their ordinals.
+    ALL_BEE_TYPES: typing.Tuple['BeeType', ...] = ()
+    MUNDANE_BEE_TYPES: typing.Tuple['BeeType', ...] = ()
+    COMPLEX_BEE_TYPES: typing.Tuple['BeeType', ...] = ()
+
+    #: Every bee type, keyed by their names.
+    BEE_TYPES_BY_NAME: typing.Dict[str, 'BeeType'] = {}
+
+    #: The result of combining each pair of bee types, indexed by their ordinals.
+    COMBINATION_MATRIX = []
+
+    #: What each bee type can be crossed into, and what it can be made from.
+    BREEDING_GRAPH: BreedingGraph = None
 
     def __init__(self, value: str):
         self.name = value.upper()
         self.value = value.lower()
+        self.ordinal = None  # Set when the registry is built
 
     def __eq__(self, other):
         return self.name == other.name
@@ -38,11 +63,27 @@ class BeeType(object):
     def __repr__(self):
         return f"{self.__class__.__name__}('{self.name}')"
 
+    @classmethod
+    def build_registry(cls):
+        """
+        Collect the bee types that have been set on the class, giving each of them an
+        ordinal (in name order).
+        """
+
+        bee_types = sorted(
+            (i for i in vars(cls).values() if isinstance(i, BeeType)),
+            key=lambda i: i.name,
+        )
+        for ordinal, bee_type in enumerate(bee_types):
+            bee_type.ordinal = ordinal
+        cls.ALL_BEE_TYPES = tuple(bee_types)
+        cls.MUNDANE_BEE_TYPES = tuple(i for i in bee_types if isinstance(i, MundaneBeeType))
+        cls.COMPLEX_BEE_TYPES = tuple(i for i in bee_types if isinstance(i, ComplexBeeType))
+        cls.BEE_TYPES_BY_NAME = {i.name: i for i in bee_types}
+
     @classmethod
     def get_mundane_bees(cls):
-        for i in cls.get_all_bees():
-            if isinstance(i, MundaneBeeType):
-                yield i
+        return cls.MUNDANE_BEE_TYPES
 
     @property
     def is_mundane(self):
@@ -50,15 +91,7 @@ class BeeType(object):
 
     @classmethod
     def get_all_bees(cls):
-        items = dir(cls)
-        for i in items:
-            if i == ["BEE_COMBINATIONS", "BEE_TYPE_VALUES", "BEE_TYPE_COMBS"]:
-                continue
-            if not i.isupper():
-                continue
-            x = getattr(cls, i)
-            if isinstance(x, BeeType):
-                yield x
+        return cls.ALL_BEE_TYPES
 
     @classmethod
     def get(cls, value: str):
@@ -66,17 +99,19 @@ class BeeType(object):
         Get a given bee type.
         """
 
-        return getattr(cls, value.upper(), None)
+        return cls.BEE_TYPES_BY_NAME.get(value.upper())
 
     def get_comb(self) -> str:
         return self.BEE_TYPE_COMBS[self]
 
+    def get_comb_name(self) -> str:
+        return f"{self.get_comb().title()} Comb"
+
     def get_value(self) -> int:
         return self.BEE_TYPE_VALUES[self]
 
     def get_comb_value(self) -> int:
-        this_comb = self.get_comb()
-        return min((o for i, o in self.BEE_TYPE_VALUES.items() if i.get_comb() == this_comb))
+        return self.BEE_COMB_VALUES[self.get_comb()]
 
     @staticmethod
     def check_if_matches(item, comparable):
@@ -89,6 +124,27 @@ class BeeType(object):
         except TypeError:
             return item.name == comparable.name
 
+    @classmethod
+    def compile_combinations(cls):
+        """
+        Work out the result of combining every pair of bee types, so that combining
+        two bees is a lookup rather than a search through the combinations. The first
+        combination that matches a pair is the one that's used.
+        """
+
+        bee_types = cls.ALL_BEE_TYPES
+        matrix = [[None] * len(bee_types) for _ in bee_types]
+        for (i, o), v in cls.BEE_COMBINATIONS.items():
+            left_matches = [t.ordinal for t in bee_types if cls.check_if_matches(t, i)]
+            right_matches = [t.ordinal for t in bee_types if cls.check_if_matches(t, o)]
+            for left in left_matches:
+                for right in right_matches:
+                    if matrix[left][right] is None:
+                        matrix[left][right] = v
+                    if matrix[right][left] is None:
+                        matrix[right][left] = v
+        cls.COMBINATION_MATRIX = matrix
+
     @classmethod
     def combine(cls, first: 'BeeType', second: 'BeeType', *, return_all_types: bool = False):
         """
@@ -100,16 +156,12 @@ class BeeType(object):
             return first
 
         # Let's see how the combinations line up
-        for (i, o), v in cls.BEE_COMBINATIONS.items():
-            checks = [
-                cls.check_if_matches(first, i) and cls.check_if_matches(second, o),
-                cls.check_if_matches(first, o) and cls.check_if_matches(second, i),
-            ]
-            if any(checks):
-                if isinstance(v, (list, tuple)) and not return_all_types:
-                    return random.choice(v)
-                return v
-        return random.choice([first, second])
+        v = cls.COMBINATION_MATRIX[first.ordinal][second.ordinal]
+        if v is None:
+            return random.choice([first, second])
+        if isinstance(v, (list, tuple)) and not return_all_types:
+            return random.choice(v)
+        return v
 
 
 class MundaneBeeType(BeeType):
@@ -159,6 +211,7 @@ def setup_bee_types():
     BeeType.ICY = ComplexBeeType("icy")
     BeeType.GLACIAL = ComplexBeeType("glacial")
     BeeType.RURAL = ComplexBeeType("rural")
+    BeeType.build_registry()
 
     # Bee combinations
     BeeType.BEE_COMBINATIONS = {
@@ -189,19 +242,13 @@ def setup_bee_types():
             if left == right:
                 continue
             BeeType.BEE_COMBINATIONS.update({(left, right,): BeeType.get("COMMON")})
+    BeeType.compile_combinations()
+    BeeType.BREEDING_GRAPH = BreedingGraph(
+        BeeType.ALL_BEE_TYPES, BeeType.MUNDANE_BEE_TYPES, BeeType.COMBINATION_MATRIX,
+    )
 
-    # Bee values
-    for i in BeeType.get_mundane_bees():
-        BeeType.BEE_TYPE_VALUES[i] = 1
-    for _ in range(5):
-        for (left, right), result in BeeType.BEE_COMBINATIONS.items():
-            if not isinstance(result, (list, tuple)):
-                result = [result]
-            for r in result:
-                BeeType.BEE_TYPE_VALUES[r] = max(
-                    BeeType.BEE_TYPE_VALUES.get(left, 1),
-                    BeeType.BEE_TYPE_VALUES.get(right, 1),
-                ) + 1
+    # Bee values - how many generations it takes to breed each type
+    BeeType.BEE_TYPE_VALUES = BeeType.BREEDING_GRAPH.get_generations()
 
     # Bee combs
     BeeType.BEE_TYPE_COMBS = {
@@ -237,6 +284,9 @@ def setup_bee_types():
         BeeType.get("GLACIAL"): "frozen",
         BeeType.get("RURAL"): "wheaten",
     }
+    for i, value in BeeType.BEE_TYPE_VALUES.items():
+        comb = i.get_comb()
+        BeeType.BEE_COMB_VALUES[comb] = min(value, BeeType.BEE_COMB_VALUES.get(comb, value))
 
 
 setup_bee_types()
@@ -249,14 +299,27 @@ class Bee(object):
     __slots__ = (
         'id', 'parent_ids', 'guild_id', 'owner_id', 'name', '_type',
         '_nobility', 'speed', 'fertility', 'hive_id',
-        'hive', 'lifetime', 'lived_lifetime',
+        'hive', 'lifetime', 'hive_entered_at', 'hive_expires_at',
     )
 
+    #: The queens that are in hives, keyed by the tick that they're going to die on.
+    death_wheel: TimerWheel = TimerWheel(get_tick())
+
+    #: The queens that are in hives, keyed by the next tick that they're going to make combs on.
+    production_wheel: TimerWheel = TimerWheel(get_tick())
+
+    #: Batches up concurrent fetches of bees by their ID.
+    id_loader: DataLoader = user_cache.add_loader(DataLoader(lambda db, keys: Bee.batch_fetch_bees_by_id(db, keys)))
+
+    #: Batches up concurrent fetches of bees by their (guild ID, owner ID).
+    user_loader: DataLoader = user_cache.add_loader(DataLoader(lambda db, keys: Bee.batch_fetch_bees_by_user(db, keys)))
+
     def __init__(
             self, id: str, parent_ids: typing.List[str], hive_id: str,
             nobility: typing.Union[str, Nobility], speed: int, fertility: int,
             owner_id: int, name: str, type: typing.Union[str, BeeType],
-            guild_id: int, lifetime: int, lived_lifetime: int):
+            guild_id: int, lifetime: int, hive_entered_at: dt.datetime = None,
+            hive_expires_at: dt.datetime = None):
 
         #: The ID of this bee.
         self.id: str = id
@@ -294,8 +357,22 @@ class Bee(object):
         #: How many ticks this bee stays alive for when it's in a hive.
         self.lifetime: int = lifetime
 
-        #: How many ticks this bee has been in a hive for.
-        self.lived_lifetime: int = lived_lifetime
+        #: When this bee was put into its hive.
+        self.hive_entered_at: typing.Optional[dt.datetime] = hive_entered_at
+
+        #: When this bee is going to die in its hive.
+        self.hive_expires_at: typing.Optional[dt.datetime] = hive_expires_at
+
+    @property
+    def lived_lifetime(self) -> int:
+        """
+        How many ticks this bee has been in a hive for.
+        """
+
+        if self.hive_entered_at is None:
+            return 0
+        lived = (dt.datetime.utcnow() - self.hive_entered_at) // TICK_LENGTH
+        return max(min(lived, self.lifetime), 0)
 
     @property
     def display_name(self):
@@ -386,69 +463,355 @@ class Bee(object):
         Have this bee die, leaving behind a princess and a series of drones.
         """
 
+        return await self.die_many(db, [self])
+
+    @classmethod
+    async def die_many(cls, db, queens: typing.List['Bee'], *, transaction: bool = True) -> typing.List['Bee']:
+        """
+        Have a series of queens die at once, each leaving behind a princess, a series of drones,
+        and a comb in their hive (saved along with their deaths), and queue a notification for
+        each owner. This runs the same handful of queries no matter how many queens there are.
+        If `transaction` is False then the caller is expected to have started a transaction
+        already, and to commit it and invalidate the owners' caches itself.
+        """
+
         # Only queens can perish
-        if self.nobility != Nobility.QUEEN:
+        if [i for i in queens if i.nobility != Nobility.QUEEN]:
             raise ValueError()
+        if not queens:
+            return []
 
         # Generate our new bees
-        def make_new_bee(nobility):
-            v = self.__class__(
-                id=None,
-                parent_ids=[self.id],
-                hive_id=self.hive_id,
+        def make_new_bee(queen, nobility, name):
+            v = cls(
+                id=str(uuid.uuid4()),
+                parent_ids=[queen.id],
+                hive_id=queen.hive_id,
                 nobility=nobility,
-                owner_id=self.owner_id,
-                name=None,
-                type=self.type,
-                guild_id=self.guild_id,
-                lived_lifetime=0,
-                **self.get_new_stats(self),
+                owner_id=queen.owner_id,
+                name=name,
+                type=queen.type,
+                guild_id=queen.guild_id,
+                **cls.get_new_stats(queen),
             )
-            v.hive = self.hive
+            v.hive = queen.hive
             return v
-        new_bees = [make_new_bee(Nobility.PRINCESS)]
-        new_bees.extend((make_new_bee(Nobility.DRONE) for _ in range(self.fertility)))
+        new_bees = []
+        for queen in queens:
+            new_bees.append(make_new_bee(queen, Nobility.PRINCESS, queen.name))
+            new_bees.extend((make_new_bee(queen, Nobility.DRONE, get_random_name()) for _ in range(queen.fertility)))
 
-        # Add a comb to the hive
+        # Work out who to tell about what
+        notifications = [(i.owner_id, i.hive_id, i.name,) for i in queens]
+        owners = {(i.guild_id, i.owner_id,) for i in queens}
+
+        # Database time
+        if transaction:
+            await db.start_transaction()
+
+        # Update (kill) our current bees
+        await db(
+            """
+            UPDATE
+                bees
+            SET
+                owner_id = NULL,
+                hive_id = NULL,
+                hive_entered_at = NULL,
+                hive_expires_at = NULL
+            WHERE
+                id = ANY($1::TEXT[])
+            """,
+            [i.id for i in queens],
+        )
+        death_combs = InventoryBuffer()
+        for queen in queens:
+            death_combs.add(queen.hive_id, queen.type.get_comb_name())
+        await InventoryBuffer.write(db, death_combs.take())
+        for queen in queens:
+            queen.owner_id = None
+            queen.hive_id = None
+            queen.hive_entered_at = None
+            queen.hive_expires_at = None
+            cls.cancel_schedules(queen.id)
+
+        # Let the owners know that their queens have died
         await db(
             """
             INSERT INTO
-                hive_inventory
-                (hive_id, item_name, quantity)
-            VALUES
-                ($1, INITCAP($2 || ' Comb'), 1)
-            ON CONFLICT
-                (hive_id, item_name)
-            DO UPDATE SET
-                quantity = hive_inventory.quantity + excluded.quantity
+                death_notifications
+                (user_id, hive_id, queen_name)
+            SELECT
+                *
+            FROM
+                UNNEST($1::BIGINT[], $2::TEXT[], $3::TEXT[])
             """,
-            self.hive_id, self.type.get_comb(),
+            [i[0] for i in notifications], [i[1] for i in notifications], [i[2] for i in notifications],
         )
 
-        # Update (kill) our current bee
-        self.owner_id = None
-        self.hive_id = None
-        await self.update(db)
-
-        # Save the new bees to database
-        new_bees[0].name = self.name
-        for bee in new_bees:
-            await bee.update(db)
+        # Save the new bees to database, picking new names for any that clash with
+        # the names of the owner's other bees
+        unsaved_bees = {i.id: i for i in new_bees}
+        while unsaved_bees:
+            bees = list(unsaved_bees.values())
+            rows = await db(
+                """
+                INSERT INTO
+                    bees
+                    (id, parent_ids, guild_id, owner_id, hive_id, name, type, nobility, speed, fertility, lifetime)
+                SELECT
+                    id, ARRAY[parent_id], guild_id, owner_id, hive_id, name, type, nobility::nobility,
+                    speed, fertility, lifetime
+                FROM
+                    UNNEST(
+                        $1::TEXT[], $2::TEXT[], $3::BIGINT[], $4::BIGINT[], $5::TEXT[], $6::TEXT[],
+                        $7::TEXT[], $8::TEXT[], $9::INTEGER[], $10::INTEGER[], $11::INTEGER[]
+                    ) AS new_bees(
+                        id, parent_id, guild_id, owner_id, hive_id, name, type, nobility,
+                        speed, fertility, lifetime
+                    )
+                ON CONFLICT DO NOTHING
+                RETURNING
+                    id
+                """,
+                [i.id for i in bees], [i.parent_ids[0] for i in bees], [i.guild_id for i in bees],
+                [i.owner_id for i in bees], [i.hive_id for i in bees], [i.name for i in bees],
+                [i.type.value for i in bees], [i.nobility.value for i in bees], [i.speed for i in bees],
+                [i.fertility for i in bees], [i.lifetime for i in bees],
+            )
+            for row in rows:
+                unsaved_bees.pop(row['id'])
+            for bee in unsaved_bees.values():
+                bee.name = get_random_name()
+        if transaction:
+            await db.commit_transaction()
+            for guild_id, user_id in owners:
+                user_cache.invalidate(guild_id, user_id)
 
         # And return the new ones
         return new_bees
 
+    @classmethod
+    def schedule_production(cls, bee_id: str, hive_id: str, bee_type: str, speed: int, death_tick: int, *, after: int):
+        """
+        Pick the next tick that a queen is going to make combs on and add it to the production
+        wheel. Queens have a `speed` percent chance of making combs every tick, so the number of
+        ticks until the next one follows a geometric distribution.
+        """
+
+        chance = min(speed, 100) / 100
+        if chance <= 0:
+            cls.production_wheel.cancel(bee_id)
+            return
+        if chance >= 1:
+            gap = 1
+        else:
+            gap = 1 + int(math.log(1.0 - random.random()) / math.log(1.0 - chance))
+        tick = after + gap
+        if tick >= death_tick:
+            cls.production_wheel.cancel(bee_id)
+            return
+        cls.production_wheel.schedule(bee_id, tick, (hive_id, bee_type, speed, death_tick, tick,))
+
+    @classmethod
+    def advance_production(cls, tick: int) -> typing.List[typing.Tuple[str, str, int]]:
+        """
+        Turn the production wheel up to the given tick, giving back a `(hive_id, bee_type, quantity)`
+        tuple for every time that a queen made combs, and scheduling each of those queens' next go.
+        """
+
+        made = []
+        due = cls.production_wheel.advance(tick)
+        while due:
+            for bee_id, (hive_id, bee_type, speed, death_tick, due_tick) in due:
+                made.append((hive_id, bee_type, random.randint(1, (speed // 100) + 1),))
+                cls.schedule_production(bee_id, hive_id, bee_type, speed, death_tick, after=due_tick)
+            due = cls.production_wheel.advance(tick)
+        return made
+
+    @staticmethod
+    def get_production_between(speed: int, start_tick: int, end_tick: int) -> int:
+        """
+        Work out how many combs a queen makes in the ticks after `start_tick`, up to and
+        including `end_tick`, all in one go rather than rolling for every tick.
+        """
+
+        times = get_binomial(end_tick - start_tick, min(speed, 100) / 100)
+        most_per_time = (speed // 100) + 1
+        if most_per_time == 1:
+            return times
+        return sum(random.randint(1, most_per_time) for _ in range(times))
+
+    @classmethod
+    def add_schedules(
+            cls, bee_id: str, hive_id: str, bee_type: str, speed: int,
+            hive_entered_at: dt.datetime, hive_expires_at: dt.datetime):
+        """
+        Add a queen that's in a hive to the death and production wheels.
+        """
+
+        death_tick = get_tick(hive_expires_at, round_up=True)
+        cls.death_wheel.schedule(bee_id, death_tick, hive_id)
+        after = max(get_tick(hive_entered_at), cls.production_wheel.current_tick)
+        cls.schedule_production(bee_id, hive_id, bee_type, speed, death_tick, after=after)
+
+    @classmethod
+    def cancel_schedules(cls, bee_id: str):
+        """
+        Remove a bee from the death and production wheels.
+        """
+
+        cls.death_wheel.cancel(bee_id)
+        cls.production_wheel.cancel(bee_id)
+
+    @classmethod
+    async def load_schedules(cls, db, current_tick: int, partition: int = 0, partitions: int = 1):
+        """
+        Rebuild the death and production wheels from the queens that are currently in hives,
+        adding the combs that they would have made between the last tick that was saved and
+        the given one to the inventory buffer. Any queens that died in that time will be due
+        on the next tick. If the hives are split into partitions then only the queens in
+        the given partition are loaded.
+        """
+
+        # Grab the queens and the last tick that we got to - if this partition has never
+        # been saved (ie the number of partitions changed) then we go from the furthest back
+        # that any partition got to
+        rows = await db(
+            """
+            SELECT
+                id, hive_id, type, speed, hive_entered_at, hive_expires_at
+            FROM
+                bees
+            WHERE
+                hive_id IS NOT NULL
+                AND nobility = 'Queen'
+                AND hive_expires_at IS NOT NULL
+                AND hive_partition(hive_id, $2) = $1
+            """,
+            partition, partitions,
+        )
+        state_rows = await db(
+            """
+            SELECT
+                COALESCE(
+                    (SELECT tick FROM tick_state WHERE partition = $1),
+                    (SELECT MIN(tick) FROM tick_state)
+                ) AS tick
+            """,
+            partition,
+        )
+        last_tick = state_rows[0]['tick'] if state_rows and state_rows[0]['tick'] is not None else current_tick
+
+        # Work out what each queen made while we weren't running, and when she's next going to
+        cls.death_wheel.reset(current_tick)
+        cls.production_wheel.reset(current_tick)
+        for row in rows:
+            start_tick = max(last_tick, get_tick(row['hive_entered_at']))
+            end_tick = min(current_tick, get_tick(row['hive_expires_at'], round_up=True) - 1)
+            quantity = cls.get_production_between(row['speed'], start_tick, end_tick)
+            if quantity:
+                hive_inventory_buffer.add(row['hive_id'], BeeType.get(row['type']).get_comb_name(), quantity)
+            cls.add_schedules(
+                row['id'], row['hive_id'], row['type'], row['speed'],
+                row['hive_entered_at'], row['hive_expires_at'],
+            )
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Bee':
+        """
+        Make a bee from a row that's been turned into JSON by the database.
+        """
+
+        data = data.copy()
+        for key in ('hive_entered_at', 'hive_expires_at',):
+            data[key] = parse_json_timestamp(data[key])
+        return cls(**data)
+
+    @classmethod
+    async def batch_fetch_bees_by_id(cls, db, bee_ids: typing.List[str]) -> typing.Dict[str, asyncpg.Record]:
+        """
+        Get the rows for a batch of bees by their IDs.
+        """
+
+        rows = await db("""SELECT * FROM bees WHERE id = ANY($1::TEXT[])""", bee_ids)
+        return {i['id']: i for i in rows}
+
+    @classmethod
+    async def batch_fetch_bees_by_user(cls, db, keys: typing.List[typing.Tuple[int, int]]) -> typing.Dict[tuple, list]:
+        """
+        Get the rows for the bees owned by a batch of (guild ID, user ID) pairs, with one
+        query per guild.
+        """
+
+        users_by_guild = collections.defaultdict(list)
+        for guild_id, user_id in keys:
+            users_by_guild[guild_id].append(user_id)
+        bees = {i: [] for i in keys}
+        for guild_id, user_ids in users_by_guild.items():
+            rows = await db(
+                """SELECT * FROM bees WHERE guild_id = $1 AND owner_id = ANY($2::BIGINT[])""",
+                guild_id, user_ids,
+            )
+            for row in rows:
+                bees[(guild_id, row['owner_id'],)].append(row)
+        return bees
+
     @classmethod
     async def fetch_bee_by_id(cls, db, bee_id: str) -> typing.Optional['Bee']:
         """
         Get a bee instance by its ID.
         """
 
-        rows = await db("""SELECT * FROM bees WHERE id=$1""", bee_id)
-        try:
-            return cls(**rows[0])
-        except IndexError:
+        row = await cls.id_loader.load(db, bee_id)
+        if row is None:
             return None
+        return cls(**row)
+
+    async def fetch_ancestry(self, db, max_depth: int = 8) -> typing.Dict[str, typing.Tuple['Bee', int]]:
+        """
+        Get this bee and its ancestors up to a given number of generations back, as
+        a dict of their IDs to the bee and the closest generation it turns up in.
+        """
+
+        # Using UNION rather than UNION ALL means that each (ancestor, generation) is only
+        # followed once, so shared ancestors don't multiply the rows at every generation
+        rows = await db(
+            """
+            WITH RECURSIVE ancestry (id, depth) AS (
+                SELECT
+                    $1::TEXT, 0
+                UNION
+                SELECT
+                    UNNEST(b.parent_ids), a.depth + 1
+                FROM
+                    ancestry a
+                INNER JOIN
+                    bees b
+                ON
+                    b.id = a.id AND b.guild_id = $2
+                WHERE
+                    a.depth < $3
+            )
+            SELECT
+                b.*, MIN(a.depth) AS depth
+            FROM
+                ancestry a
+            INNER JOIN
+                bees b
+            ON
+                b.id = a.id AND b.guild_id = $2
+            GROUP BY
+                b.id
+            """,
+            self.id, self.guild_id, max_depth,
+        )
+        ancestry = {}
+        for row in rows:
+            row = dict(row)
+            depth = row.pop('depth')
+            ancestry[row['id']] = (self.__class__(**row), depth,)
+        return ancestry
 
     @classmethod
     async def fetch_bees_by_user(cls, db, guild_id: int, user_id: int) -> typing.List['Bee']:
@@ -456,16 +819,51 @@ class Bee(object):
         Gives you a list of the bees owned by the given user.
         """
 
-        rows = await db("""SELECT * FROM bees WHERE owner_id = $1 AND guild_id = $2""", user_id, guild_id)
+        # Anyone in a transaction needs to see their own writes, so they skip the cache
+        key = (guild_id, user_id,)
+        cacheable = not in_transaction(db)
+        rows = user_cache.bees.get(key) if cacheable else None
+        if rows is None:
+            version = user_cache.invalidations
+            rows = await cls.user_loader.load(db, key)
+            if cacheable:
+                user_cache.set(user_cache.bees, key, rows, version)
         return [cls(**i) for i in rows]
 
+    @classmethod
+    async def fetch_name_index(cls, db, guild_id: int, user_id: int) -> NameIndex:
+        """
+        Get the index of the names of the bees owned by the given user.
+        """
+
+        # See if we have it cached already - anyone in a transaction needs to see their
+        # own writes, so they skip the cache
+        key = (guild_id, user_id,)
+        cacheable = not in_transaction(db)
+        index = user_cache.names.get(key) if cacheable else None
+        if index is not None:
+            return index
+
+        # Build it from their cached bees if we can, or just their names if not
+        version = user_cache.invalidations
+        rows = user_cache.bees.get(key) if cacheable else None
+        if rows is None:
+            rows = await db(
+                """SELECT id, name FROM bees WHERE guild_id = $1 AND owner_id = $2 AND name IS NOT NULL""",
+                guild_id, user_id,
+            )
+        index = NameIndex((i['id'], i['name'],) for i in rows if i['name'])
+        if cacheable:
+            user_cache.set(user_cache.names, key, index, version)
+        return index
+
     @classmethod
     async def create_bee(cls, db, guild_id: int, user_id: int, bee_type: BeeType = None, nobility: Nobility = Nobility.DRONE) -> 'Bee':
         """
         Create a new bee.
         """
 
-        bee_type = bee_type or random.choice(list(BeeType.get_mundane_bees()))
+        bee_type = bee_type or random.choice(BeeType.MUNDANE_BEE_TYPES)
         while True:
             try:
                 rows = await db(
@@ -477,6 +875,7 @@ class Bee(object):
                 pass
             else:
                 break
+        user_cache.invalidate(guild_id, user_id)
         return cls(**rows[0])
 
     async def update(self, db, **kwargs):
@@ -484,6 +883,7 @@ class Bee(object):
         Create a new bee.
         """
 
+        previous_owner_id = self.owner_id
         for i, o in kwargs.items():
 
             # See if we set a hive ID
@@ -504,6 +904,14 @@ class Bee(object):
             else:
                 setattr(self, i, o)
 
+        # Start the queen's lifetime when she enters a hive
+        if self.hive_id is None:
+            self.hive_entered_at = None
+            self.hive_expires_at = None
+        elif self.nobility == Nobility.QUEEN and self.hive_entered_at is None:
+            self.hive_entered_at = dt.datetime.utcnow()
+            self.hive_expires_at = self.hive_entered_at + (TICK_LENGTH * self.lifetime)
+
         # Make sure we have some fields
         if self.id is None:
             new_bee = await self.create_bee(db, self.guild_id, self.owner_id)
@@ -528,15 +936,19 @@ class Bee(object):
                 guild_id = $9,
                 hive_id = $10,
                 lifetime = $11,
-                lived_lifetime = $12
+                hive_entered_at = $12,
+                hive_expires_at = $13
             WHERE
                 id = $1
             """,
             self.id, self.parent_ids, self.owner_id, self.name,
             self.nobility.value, self.speed, self.fertility,
             self.type.value, self.guild_id, self.hive_id,
-            self.lifetime, self.lived_lifetime,
+            self.lifetime, self.hive_entered_at, self.hive_expires_at,
         )
+        user_cache.invalidate(self.guild_id, self.owner_id)
+        if previous_owner_id != self.owner_id:
+            user_cache.invalidate(self.guild_id, previous_owner_id)
 
     async def delete(self, db):
         """
@@ -547,6 +959,7 @@ class Bee(object):
             """UPDATE bees SET owner_id=NULL WHERE id=$1""",
             self.id,
         )
+        user_cache.invalidate(self.guild_id, self.owner_id)
 
     @classmethod
     async def convert(cls, ctx, value: str):
@@ -554,149 +967,247 @@ class Bee(object):
         Get a bee instance from its name.
         """
 
+        guild_id = get_bee_guild_id(ctx)
         async with ctx.bot.database() as db:
-            rows = await db(
-                """SELECT * FROM bees WHERE owner_id=$1 AND (id=$2 OR LOWER(name)=LOWER($2)) AND guild_id=$3""",
-                ctx.author.id, value, get_bee_guild_id(ctx),
-            )
-        if not rows:
+            index = await cls.fetch_name_index(db, guild_id, ctx.author.id)
+            bee = await cls.fetch_bee_by_id(db, index.get(value) or value)
+        if bee is None or bee.guild_id != guild_id or bee.owner_id != ctx.author.id:
             raise commands.BadArgument("You don't have a bee with that name!")
-        return cls(**rows[0])
+        return bee
+
+    @classmethod
+    def get_filter_condition(
+            cls, guild_id: int, user_id: int, *, nobility: Nobility = None, bee_type: BeeType = None,
+            in_hive: bool = None) -> typing.Tuple[str, list]:
+        """
+        Get the SQL condition (and its arguments) for the bees owned by a user that
+        pass the given filters. Filters left as None aren't applied.
+        """
+
+        conditions = ["guild_id = $1", "owner_id = $2"]
+        args = [guild_id, user_id]
+        if nobility is not None:
+            args.append(nobility.value)
+            conditions.append(f"nobility = ${len(args)}")
+        if bee_type is not None:
+            args.append(bee_type.value)
+            conditions.append(f"type = ${len(args)}")
+        if in_hive is not None:
+            conditions.append("hive_id IS NOT NULL" if in_hive else "hive_id IS NULL")
+        return " AND ".join(conditions), args
+
+    @classmethod
+    async def count_bees_by(cls, db, column: str, condition: str, *args) -> typing.Dict[str, int]:
+        """
+        Count the bees that match an SQL condition, grouped by one of their columns.
+        """
+
+        rows = await db(
+            """SELECT {0} AS value, COUNT(*) AS count FROM bees WHERE {1} GROUP BY {0}""".format(column, condition),
+            *args,
+        )
+        return {i['value']: i['count'] for i in rows}
+
+    @classmethod
+    async def fetch_bee_page(
+            cls, db, condition: str, *args, after: typing.Tuple[str, str] = None,
+            limit: int = 25) -> typing.List['Bee']:
+        """
+        Get a page of the bees that match an SQL condition, ordered by name. The next
+        page starts after the (name, ID) of the last bee on this one, so we never need
+        to read through the pages before it.
+        """
+
+        args = list(args)
+        if after is not None:
+            args.extend(after)
+            condition = f"{condition} AND (COALESCE(name, id::CITEXT), id) > (${len(args) - 1}::CITEXT, ${len(args)})"
+        rows = await db(
+            """
+            SELECT
+                *
+            FROM
+                bees
+            WHERE
+                {0}
+            ORDER BY
+                COALESCE(name, id::CITEXT), id
+            LIMIT ${1}
+            """.format(condition, len(args) + 1),
+            *args, limit,
+        )
+        return [cls(**i) for i in rows]
 
     @classmethod
     async def send_bee_dropdown(
             cls, ctx: vbu.Context, send_method, current_message: discord.Message, max_values: int = 1, *,
-            group_by_nobility: bool = False, group_by_type: bool = False, check=None,
-            content: str = None, no_available_bees_content: str = None) -> typing.Tuple[vbu.ComponentInteractionPayload, discord.Message, typing.List['Bee']]:
+            group_by_nobility: bool = False, group_by_type: bool = False, nobility: Nobility = None,
+            in_hive: bool = None, content: str = None,
+            no_available_bees_content: str = None) -> typing.Tuple[vbu.ComponentInteractionPayload, discord.Message, typing.List['Bee']]:
         """
-        Send a dropdown to let a user pick one of their bees.
+        Send a dropdown to let a user pick one of their bees, a page at a time.
         """
 
-        # Grab the bees
+        # Count the bees that they can pick from
+        guild_id = get_bee_guild_id(ctx)
+        condition, args = cls.get_filter_condition(guild_id, ctx.author.id, nobility=nobility, in_hive=in_hive)
         async with ctx.bot.database() as db:
-            bees = await cls.fetch_bees_by_user(db, get_bee_guild_id(ctx), ctx.author.id)
-
-        # Make sure a check exists
-        if check is None:
-            check = lambda _: True  # noqa
-
-        # Get the check
-        bees = {i.id: i for i in bees if check(i)}
+            nobility_counts = await cls.count_bees_by(db, "nobility", condition, *args)
 
         # Make sure there are bees
-        if not bees:
+        if not nobility_counts:
             no_available_bees_content = no_available_bees_content or "You have no available bees :<"
             current_message = await send_method(content=no_available_bees_content, components=None) or current_message
             return (None, current_message, None,)
 
         # See if we want to group by royalty
-        if group_by_nobility:
-            if len(set([i.nobility for i in bees.values()])) > 1:
-                queens = {i: o for i, o in bees.items() if o.nobility == Nobility.QUEEN}
-                princesses = {i: o for i, o in bees.items() if o.nobility == Nobility.PRINCESS}
-                drones = {i: o for i, o in bees.items() if o.nobility == Nobility.DRONE}
-
-                # Ask what kind of bee they want to get rid of
-                components = vbu.MessageComponents(
-                    vbu.ActionRow(
-                        vbu.Button("Queen", custom_id="CHOOSE_QUEEN", disabled=not bool(queens)),
-                        vbu.Button("Princess", custom_id="CHOOSE_PRINCESS", disabled=not bool(princesses)),
-                        vbu.Button("Drone", custom_id="CHOOSE_DRONES", disabled=not bool(drones)),
-                    ),
-                    vbu.ActionRow(
-                        vbu.Button("Cancel", custom_id="CANCEL", style=vbu.ButtonStyle.DANGER)
-                    ),
+        if group_by_nobility and len(nobility_counts) > 1:
+
+            # Ask what kind of bee they want to get rid of
+            buttons = [
+                vbu.Button(
+                    f"{i.value} ({nobility_counts.get(i.value, 0)})", custom_id=f"CHOOSE_{i.name}",
+                    disabled=not nobility_counts.get(i.value),
                 )
+                for i in (Nobility.QUEEN, Nobility.PRINCESS, Nobility.DRONE,)
+            ]
+            components = vbu.MessageComponents(
+                vbu.ActionRow(*buttons),
+                vbu.ActionRow(
+                    vbu.Button("Cancel", custom_id="CANCEL", style=vbu.ButtonStyle.DANGER)
+                ),
+            )
+            current_message = await send_method(
+                content="What kind of bee would you like to choose?",
+                components=components,
+            ) or current_message
+            try:
+                payload = await ctx.bot.wait_for("component_interaction", check=vbu.component_check(ctx.author, current_message), timeout=60)
+            except asyncio.TimeoutError:
                 current_message = await send_method(
-                    content="What kind of bee would you like to choose?",
-                    components=components,
+                    content="I timed out waiting for you to say what nobility of bee you want to select :<",
+                    components=None,
                 ) or current_message
-                try:
-                    payload = await ctx.bot.wait_for("component_interaction", check=vbu.component_check(ctx.author, current_message), timeout=60)
-                except asyncio.TimeoutError:
-                    current_message = await send_method(
-                        content="I timed out waiting for you to say what nobility of bee you want to select :<",
-                        components=None,
-                    ) or current_message
-                    return (None, current_message, None,)
-                if payload.component.custom_id == "CHOOSE_QUEEN":
-                    bees = queens
-                elif payload.component.custom_id == "CHOOSE_PRINCESS":
-                    bees = princesses
-                elif payload.component.custom_id == "CHOOSE_DRONES":
-                    bees = drones
-                else:
-                    current_message = await payload.update_message(content="Cancelled your bee selection :<", components=None) or current_message
-                    return (payload, current_message, None,)
-                send_method = payload.update_message
+                return (None, current_message, None,)
+            if payload.component.custom_id == "CANCEL":
+                current_message = await payload.update_message(content="Cancelled your bee selection :<", components=None) or current_message
+                return (payload, current_message, None,)
+            nobility = Nobility[payload.component.custom_id[len("CHOOSE_"):]]
+            condition, args = cls.get_filter_condition(guild_id, ctx.author.id, nobility=nobility, in_hive=in_hive)
+            send_method = payload.update_message
 
         # See if we want to group by type
         if group_by_type:
-            bee_types = sorted(list(set([o.type.value for o in bees.values()])))
-            if len(bee_types) > 1:
-                components = vbu.MessageComponents(
-                    vbu.ActionRow(
-                        vbu.SelectMenu(
-                            custom_id="BEE_SELECTION",
-                            options=[
-                                vbu.SelectOption(label=i.title(), value=i)
-                                for i in bee_types
-                            ],
-                            placeholder="What type of bee would you like to select?",
+            async with ctx.bot.database() as db:
+                type_counts = await cls.count_bees_by(db, "type", condition, *args)
+            if len(type_counts) > 1:
+
+                # There can be more types than fit in one dropdown, so we page through them
+                bee_types = sorted(type_counts.items(), key=lambda i: (-i[1], i[0],))
+                page = 0
+                while True:
+                    page_types = bee_types[page * 25:(page + 1) * 25]
+                    components = vbu.MessageComponents(
+                        vbu.ActionRow(
+                            vbu.SelectMenu(
+                                custom_id="BEE_SELECTION",
+                                options=[
+                                    vbu.SelectOption(label=i.title(), value=i, description=vbu.format("{0} {0:plural,bee,bees}", count))
+                                    for i, count in page_types
+                                ],
+                                placeholder="What type of bee would you like to select?",
+                            ),
                         ),
-                    ),
-                    vbu.ActionRow(
-                        vbu.Button("Cancel", custom_id="CANCEL", style=vbu.ButtonStyle.DANGER),
-                    ),
+                        vbu.ActionRow(
+                            vbu.Button(label="Previous", custom_id="PREVIOUS", disabled=page == 0),
+                            vbu.Button(label="Next", custom_id="NEXT", disabled=(page + 1) * 25 >= len(bee_types)),
+                            vbu.Button("Cancel", custom_id="CANCEL", style=vbu.ButtonStyle.DANGER),
+                        ),
+                    )
+                    current_message = await send_method(content="What type of bee would you like to select?", components=components) or current_message
+                    try:
+                        payload = await ctx.bot.wait_for("component_interaction", check=vbu.component_check(ctx.author, current_message), timeout=60)
+                    except asyncio.TimeoutError:
+                        current_message = await send_method(
+                            content="I timed out waiting for you to what bee you want to select :c",
+                            components=None,
+                        ) or current_message
+                        return (None, current_message, None,)
+                    send_method = payload.update_message
+                    if payload.component.custom_id == "CANCEL":
+                        current_message = await payload.update_message(content="Cancelled your bee selection :<", components=None) or current_message
+                        return (payload, current_message, None,)
+                    if payload.component.custom_id == "NEXT":
+                        page += 1
+                        continue
+                    if payload.component.custom_id == "PREVIOUS":
+                        page -= 1
+                        continue
+                    break
+                condition, args = cls.get_filter_condition(
+                    guild_id, ctx.author.id, nobility=nobility, bee_type=BeeType.get(payload.values[0]),
+                    in_hive=in_hive,
                 )
-                current_message = await send_method(content="What type of bee would you like to select?", components=components) or current_message
-                try:
-                    payload = await ctx.bot.wait_for("component_interaction", check=vbu.component_check(ctx.author, current_message), timeout=60)
-                except asyncio.TimeoutError:
-                    current_message = await send_method(
-                        content="I timed out waiting for you to what bee you want to select :c",
-                        components=None,
-                    ) or current_message
-                if payload.component.custom_id == "CANCEL":
-                    current_message = await payload.update_message(content="Cancelled your bee selection :<", components=None) or current_message
-                    return (payload, current_message, None,)
-                send_method = payload.update_message
-                bees = {i: o for i, o in bees.items() if o.type.value.casefold() == payload.values[0].casefold()}
-
-        # Make components
-        components = vbu.MessageComponents(
-            vbu.ActionRow(vbu.SelectMenu(
-                custom_id="BEE_SELECTION",
-                options=[
-                    vbu.SelectOption(label=bee.name, value=bee.id, description=bee.display_type.capitalize())
-                    for bee in list(bees.values())[:25]
-                ],
-                max_values=min(max_values, len(bees), 25),
-                placeholder="Which bee would you like to choose?"
-            )),
-            vbu.ActionRow(vbu.Button(
-                label="Cancel",
-                custom_id="CANCEL",
-                style=vbu.ButtonStyle.DANGER,
-            )),
-        )
 
-        # Send message
+        # Go through the pages until they pick some bees; we keep where each page we've
+        # been to starts so that they can go back
+        page_starts = [None]
         content = content or "Which bee would you like to choose?"
-        current_message = await send_method(content=content, components=components) or current_message
+        while True:
 
-        # Wait for interaction
-        try:
-            payload = await ctx.bot.wait_for("component_interaction", check=vbu.component_check(ctx.author, current_message), timeout=60)
-        except asyncio.TimeoutError:
-            current_message = await send_method(content="I timed out waiting for you to select a bee :c", components=None) or current_message
-            return (None, current_message, None,)
+            # Grab the page, with an extra bee to see if there's a next one
+            async with ctx.bot.database() as db:
+                bees = await cls.fetch_bee_page(db, condition, *args, after=page_starts[-1], limit=26)
+            has_next_page = len(bees) > 25
+            bees = {i.id: i for i in bees[:25]}
+            if not bees:
+                no_available_bees_content = no_available_bees_content or "You have no available bees :<"
+                current_message = await send_method(content=no_available_bees_content, components=None) or current_message
+                return (None, current_message, None,)
+
+            # Make components
+            components = vbu.MessageComponents(
+                vbu.ActionRow(vbu.SelectMenu(
+                    custom_id="BEE_SELECTION",
+                    options=[
+                        vbu.SelectOption(label=bee.display_name, value=bee.id, description=bee.display_type.capitalize())
+                        for bee in bees.values()
+                    ],
+                    max_values=min(max_values, len(bees), 25),
+                    placeholder="Which bee would you like to choose?"
+                )),
+                vbu.ActionRow(
+                    vbu.Button(label="Previous", custom_id="PREVIOUS", disabled=len(page_starts) == 1),
+                    vbu.Button(label="Next", custom_id="NEXT", disabled=not has_next_page),
+                    vbu.Button(label="Cancel", custom_id="CANCEL", style=vbu.ButtonStyle.DANGER),
+                ),
+            )
+
+            # Send message
+            current_message = await send_method(content=content, components=components) or current_message
 
-        # See if it were cancelled
-        if payload.component.custom_id == "CANCEL":
-            current_message = await payload.update_message(content="Cancelled your bee selection :<", components=None) or current_message
-            return (payload, current_message, None,)
+            # Wait for interaction
+            try:
+                payload = await ctx.bot.wait_for("component_interaction", check=vbu.component_check(ctx.author, current_message), timeout=60)
+            except asyncio.TimeoutError:
+                current_message = await send_method(content="I timed out waiting for you to select a bee :c", components=None) or current_message
+                return (None, current_message, None,)
+            send_method = payload.update_message
+
+            # See if it were cancelled
+            if payload.component.custom_id == "CANCEL":
+                current_message = await payload.update_message(content="Cancelled your bee selection :<", components=None) or current_message
+                return (payload, current_message, None,)
+
+            # See if they changed page
+            if payload.component.custom_id == "NEXT":
+                last_bee = list(bees.values())[-1]
+                page_starts.append((last_bee.display_name, last_bee.id,))
+                continue
+            if payload.component.custom_id == "PREVIOUS":
+                page_starts.pop()
+                continue
 
-        # Return the bee
-        specified_bees = [bees[i] for i in payload.values]
-        return (payload, current_message, specified_bees,)
+            # Return the bee
+            specified_bees = [bees[i] for i in payload.values]
+            return (payload, current_message, specified_bees,)
@@ -0,0 +1,215 @@
+import collections
+import heapq
+import itertools
+import math
+import typing
+
+from .lru_cache import LRUCache
+
+if typing.TYPE_CHECKING:
+    from .bee import BeeType
+
+
+_MISSING = object()
+
+
+class BreedingStep(object):
+    """
+    A single step in a breeding plan - either crossing a princess of the left type
+    with a drone of the right type, or catching a mundane princess or drone (as
+    given by `princess`) if the left and right types are empty.
+    """
+
+    __slots__ = ('result', 'chance', 'left', 'right', 'princess',)
+
+    def __init__(
+            self, result: 'BeeType', chance: float, left: 'BeeType' = None, right: 'BeeType' = None,
+            *, princess: bool = None):
+        self.result: 'BeeType' = result
+        self.chance: float = chance
+        self.left: typing.Optional['BeeType'] = left
+        self.right: typing.Optional['BeeType'] = right
+        self.princess: typing.Optional[bool] = princess
+
+    @property
+    def is_catch(self) -> bool:
+        return self.left is None
+
+
+class BreedingPlan(object):
+    """
+    The steps to take to get to a given bee type, in the order that they need to be taken.
+    """
+
+    __slots__ = ('target', 'steps',)
+
+    def __init__(self, target: 'BeeType', steps: typing.List[BreedingStep]):
+        self.target: 'BeeType' = target
+        self.steps: typing.List[BreedingStep] = steps
+
+    @property
+    def chance(self) -> float:
+        """
+        The chance of every step in the plan going the way that we want it to.
+        """
+
+        return math.prod(i.chance for i in self.steps)
+
+
+class BreedingGraph(object):
+    """
+    The bee types and what they can be crossed into, compiled once from the bee combinations.
+    """
+
+    def __init__(
+            self, bee_types: typing.Iterable['BeeType'], mundane_types: typing.Iterable['BeeType'],
+            combination_matrix: typing.List[list], *, max_cached_plans: int = 10_000):
+        self.bee_types: typing.Tuple['BeeType', ...] = tuple(bee_types)
+        self.mundane_types: typing.Tuple['BeeType', ...] = tuple(mundane_types)
+
+        #: Each bee type, and the (partner, result, chance) of every cross that makes something new.
+        self.crosses: typing.Dict['BeeType', list] = collections.defaultdict(list)
+
+        #: Each bee type, and the (left, right, chance) of every cross that makes it.
+        self.recipes: typing.Dict['BeeType', list] = collections.defaultdict(list)
+
+        # Go through each pair of types - the matrix is the same both ways around
+        for left, right in itertools.combinations(self.bee_types, 2):
+            results = combination_matrix[left.ordinal][right.ordinal]
+            if results is None:
+                continue
+            if not isinstance(results, (list, tuple)):
+                results = [results]
+            chance = 1 / len(results)
+            for result in results:
+                if result in (left, right):
+                    continue
+                self.crosses[left].append((right, result, chance,))
+                self.crosses[right].append((left, result, chance,))
+                self.recipes[result].append((left, right, chance,))
+
+        #: The plans that have already been worked out, keyed by (princess types, drone types, target).
+        self.plans = LRUCache(max_size=max_cached_plans)
+
+    def search(
+            self, sources: typing.Dict[typing.Any, typing.Any], combine: typing.Callable,
+            target: 'BeeType' = None, *, by_nobility: bool = False) -> typing.Dict[typing.Any, tuple]:
+        """
+        Work out the cheapest way to get to each bee type from the given starting types
+        and their costs. The cost of a cross is worked out by the combine function from
+        the costs of its parents and its chance, and should never be lower than either
+        parent. Gives back a dict of each type reached to its (cost, (left, right, chance)),
+        where the cross is None for the starting types.
+
+        If `by_nobility` is set then the search is over (type, is princess) pairs rather
+        than types. A cross then needs a princess of one type (which is kept on the left)
+        and a drone of the other, and gives both a princess and drones of its result.
+        """
+
+        best = {}
+        counter = itertools.count()
+        heap = [(cost, next(counter), node, None,) for node, cost in sources.items()]
+        heapq.heapify(heap)
+        while heap:
+            cost, _, node, cross = heapq.heappop(heap)
+            if node in best:
+                continue
+            best[node] = (cost, cross,)
+            bee_type = node[0] if by_nobility else node
+            if target is not None and bee_type == target:
+                break
+            for partner, result, chance in self.crosses[bee_type]:
+                if by_nobility:
+                    partner_node = (partner, not node[1],)
+                    result_nodes = ((result, True,), (result, False,),)
+                    new_cross = (node, partner_node, chance,) if node[1] else (partner_node, node, chance,)
+                else:
+                    partner_node = partner
+                    result_nodes = (result,)
+                    new_cross = (bee_type, partner, chance,)
+                if partner_node not in best:
+                    continue
+                new_cost = combine(cost, best[partner_node][0], chance)
+                for result_node in result_nodes:
+                    if result_node not in best:
+                        heapq.heappush(heap, (new_cost, next(counter), result_node, new_cross,))
+        return best
+
+    def get_generations(self) -> typing.Dict['BeeType', int]:
+        """
+        Get how many generations of breeding it takes to get to each type, starting
+        with the mundane bees as the first generation.
+        """
+
+        best = self.search(
+            {i: 1 for i in self.mundane_types},
+            lambda left, right, chance: max(left, right) + 1,
+        )
+        return {bee_type: cost for bee_type, (cost, _) in best.items()}
+
+    def get_plan(
+            self, princesses: typing.Iterable['BeeType'], drones: typing.Iterable['BeeType'],
+            target: 'BeeType') -> typing.Optional[BreedingPlan]:
+        """
+        Get the most likely way to get to the target type from the princess and drone
+        types that a user owns, catching new mundane bees where needed. Each cross takes
+        a princess of one type and a drone of the other, and is assumed to give both a
+        princess and drones of its result once the queen that it makes has lived out her
+        life in a hive. Bees aren't counted as used up by the crosses that they're in.
+        Fewer crosses wins out between plans that are as likely as each other.
+        """
+
+        # See if we've worked this out already
+        princesses, drones = frozenset(princesses), frozenset(drones)
+        key = (princesses, drones, target,)
+        plan = self.plans.get(key, _MISSING)
+        if plan is not _MISSING:
+            return plan
+
+        # Find the most likely way to the target - costs are the negative log of the
+        # chance (so they add up) and then the number of crosses
+        catch_cost = -math.log(1 / len(self.mundane_types))
+        sources = {}
+        for i in self.mundane_types:
+            sources[(i, True,)] = sources[(i, False,)] = (catch_cost, 0,)
+        sources.update({(i, True,): (0.0, 0,) for i in princesses})
+        sources.update({(i, False,): (0.0, 0,) for i in drones})
+        best = self.search(
+            sources,
+            lambda left, right, chance: (left[0] + right[0] - math.log(chance), left[1] + right[1] + 1,),
+            target=target, by_nobility=True,
+        )
+
+        # Walk back through the crosses to get the steps in order
+        plan = None
+        reached = [i for i in ((target, True,), (target, False,),) if i in best]
+        if reached:
+            steps = []
+            seen = set()
+
+            def add_steps(node):
+                bee_type, is_princess = node
+                _, cross = best[node]
+                if cross is None:
+                    if node in seen:
+                        return
+                    seen.add(node)
+                    if bee_type not in (princesses if is_princess else drones):
+                        steps.append(BreedingStep(bee_type, 1 / len(self.mundane_types), princess=is_princess))
+                    return
+
+                # A cross gives both a princess and drones, so it's only ever done once
+                if bee_type in seen:
+                    return
+                seen.add(bee_type)
+                left, right, chance = cross
+                add_steps(left)
+                add_steps(right)
+                steps.append(BreedingStep(bee_type, chance, left[0], right[0]))
+
+            add_steps(reached[0])
+            plan = BreedingPlan(target, steps)
+
+        # Cache and return
+        self.plans.set(key, plan)
+        return plan
@@ -0,0 +1,105 @@
+import asyncio
+import typing
+
+from .utils import in_transaction
+
+
+class DataLoader(object):
+    """
+    Collects the keys that are asked for within one iteration of the event loop and
+    loads them all with a single call to a batch function. Anyone asking for a key
+    that's already being loaded waits on that same load. Nothing is kept once a load
+    is done - this isn't a cache.
+
+    The batch function is given a database connection and a list of keys, and should
+    give back a dict of each key to its value. Keys missing from the dict load as None.
+    Each batch runs on the connection of the first caller in it (who's only waiting on
+    the load, so it's free), so loading never takes another connection from the pool.
+    """
+
+    def __init__(self, batch_function: typing.Callable[[typing.Any, list], typing.Awaitable[dict]]):
+        self.batch_function = batch_function
+        self.pending: typing.Dict[typing.Hashable, asyncio.Future] = {}  # Waiting to be dispatched
+        self.pending_db = None  # The connection that the pending keys will be loaded on
+        self.in_flight: typing.Dict[typing.Hashable, asyncio.Future] = {}  # Being loaded right now
+
+        # Metrics
+        self.loads: int = 0
+        self.batches: int = 0
+        self.coalesced: int = 0
+
+    async def load(self, db, key):
+        """
+        Load a single key, using the given connection if a new batch is needed.
+        """
+
+        # Anyone in a transaction needs to see their own writes, so they load on their
+        # own rather than sharing with anyone else
+        self.loads += 1
+        if in_transaction(db):
+            values = await self.batch_function(db, [key])
+            return values.get(key)
+
+        # See if it's already being loaded, and start a batch if not
+        future = self.pending.get(key) or self.in_flight.get(key)
+        lending_db = False
+        if future is None:
+            loop = asyncio.get_event_loop()
+            if not self.pending:
+                loop.call_soon(self.dispatch)
+                self.pending_db = db
+                lending_db = True
+            future = loop.create_future()
+            self.pending[key] = future
+        else:
+            self.coalesced += 1
+
+        # If the batch is running on our connection then we can't give it back until
+        # the batch is done with it, even if we're cancelled
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if lending_db:
+                await asyncio.wait([future])
+            raise
+
+    def forget(self):
+        """
+        Stop new loads from waiting on the loads that are already running, as what
+        they're loading could be out of date.
+        """
+
+        self.in_flight.clear()
+
+    def dispatch(self):
+        """
+        Start loading everything that's pending.
+        """
+
+        batch, self.pending = self.pending, {}
+        db, self.pending_db = self.pending_db, None
+        self.in_flight.update(batch)
+        self.batches += 1
+        asyncio.ensure_future(self.run_batch(db, batch))
+
+    async def run_batch(self, db, batch: typing.Dict[typing.Hashable, asyncio.Future]):
+        """
+        Run the batch function for a set of keys, giving each of their futures a result.
+        """
+
+        try:
+            values = await self.batch_function(db, list(batch.keys()))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values.get(key))
+        finally:
+            for key, future in batch.items():
+                if not future.done():
+                    future.cancel()
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
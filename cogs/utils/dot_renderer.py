@@ -0,0 +1,171 @@
+import asyncio
+import os
+import signal
+import time
+import typing
+
+
+class RenderError(Exception):
+    """
+    Graphviz couldn't render a graph, or took too long to.
+    """
+
+
+async def render_dot(source: str, *, format: str = "png:cairo", timeout: typing.Optional[float] = 10.0) -> bytes:
+    """
+    Render some DOT source with Graphviz, piping it in and the image back out so
+    that nothing touches the disk. The process (and anything that it's started) is
+    killed if it runs over time.
+    """
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "dot", f"-T{format}", "-Gcharset=UTF-8",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+    except OSError as e:
+        raise RenderError("Could not start Graphviz") from e
+    finished = False
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(source.encode()), timeout)
+        finished = True
+    except asyncio.TimeoutError:
+        raise RenderError(f"Graphviz took longer than {timeout} seconds") from None
+    finally:
+        if not finished:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass  # It already died
+            await process.wait()
+    if process.returncode != 0:
+        raise RenderError(stderr.decode(errors="replace").strip() or f"Graphviz exited with {process.returncode}")
+    return stdout
+
+
+class RenderBusy(RenderError):
+    """
+    The render pool's queue is full.
+    """
+
+
+class RenderPool(object):
+    """
+    Renders DOT source on a fixed number of workers, so that only so many Graphviz
+    processes ever run at once. Renders wait in a bounded queue, and are turned away
+    straight off if it's full. A user asking for a render that's identical to one
+    they're already waiting on gets the same image rather than another render.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 20, timeout: typing.Optional[float] = 10.0):
+        self.worker_count: int = workers
+        self.max_queue: int = max_queue
+        self.timeout: typing.Optional[float] = timeout
+        self.queue: typing.Optional[asyncio.Queue] = None
+        self.workers: typing.List[asyncio.Task] = []
+        self.in_flight: typing.Dict[tuple, asyncio.Future] = {}  # Keyed by (user ID, source)
+
+        # Metrics
+        self.rendered: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.deduplicated: int = 0
+        self.max_queue_depth: int = 0
+        self.wait_time: float = 0.0  # Total time spent in the queue, in seconds
+        self.render_time: float = 0.0  # Total time spent rendering, in seconds
+
+    @property
+    def queue_depth(self) -> int:
+        if self.queue is None:
+            return 0
+        return self.queue.qsize()
+
+    @property
+    def average_wait_time(self) -> float:
+        renders = self.rendered + self.failed
+        if not renders:
+            return 0.0
+        return self.wait_time / renders
+
+    @property
+    def average_render_time(self) -> float:
+        renders = self.rendered + self.failed
+        if not renders:
+            return 0.0
+        return self.render_time / renders
+
+    def start(self):
+        """
+        Start the workers, if they aren't running already.
+        """
+
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.workers = [asyncio.ensure_future(self.run_worker()) for _ in range(self.worker_count)]
+
+    def close(self):
+        """
+        Stop the workers, failing anything that's still waiting to be rendered.
+        """
+
+        for worker in self.workers:
+            worker.cancel()
+        self.workers.clear()
+        for future in self.in_flight.values():
+            if not future.done():
+                future.set_exception(RenderError("The render pool was closed"))
+        self.in_flight.clear()
+        self.queue = None
+
+    async def render(self, user_id: int, source: str) -> bytes:
+        """
+        Render some DOT source for a given user once a worker is free.
+        """
+
+        # See if they're already waiting on this
+        key = (user_id, source,)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(future)
+
+        # Add it to the queue if there's space
+        self.start()
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((key, source, future, time.perf_counter(),))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise RenderBusy("There are too many renders waiting already")
+        self.in_flight[key] = future
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return await asyncio.shield(future)
+
+    async def run_worker(self):
+        """
+        Render whatever's in the queue, one item at a time. Anything that goes wrong
+        with a render is given to whoever's waiting on it, and the worker carries on.
+        """
+
+        while True:
+            key, source, future, queued_at = await self.queue.get()
+            started_at = time.perf_counter()
+            self.wait_time += started_at - queued_at
+            try:
+                image = await render_dot(source, timeout=self.timeout)
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.rendered += 1
+                if not future.done():
+                    future.set_result(image)
+            finally:
+                self.render_time += time.perf_counter() - started_at
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
@@ -1,7 +1,11 @@
 import typing
+import collections
 import random
 import uuid
 import asyncio
+import json
+import os
+import tempfile
 
 import discord
 from discord.ext import commands
@@ -9,8 +13,12 @@ import voxelbotutils as vbu
 
 from .bee import Bee
 from .item import Inventory
+from .inventory_buffer import hive_inventory_buffer
 from .hive_cell_emoji import HiveCellEmoji
-from .utils import get_bee_guild_id
+from .lru_cache import LRUCache
+from .user_cache import user_cache
+from .data_loader import DataLoader
+from .utils import get_bee_guild_id, in_transaction
 
 
 HIVE_NAMES = [
@@ -28,6 +36,12 @@ class Hive(object):
         'id', 'index', 'guild_id', 'owner_id', 'bees', 'inventory',
     )
 
+    #: The hive grids that have already been made, keyed by (hive ID, width, height).
+    grid_cache: LRUCache = LRUCache(max_size=2_000)
+
+    #: Batches up concurrent fetches of hive rows by their (guild ID, owner ID, fetch bees, fetch inventory).
+    user_loader: DataLoader = user_cache.add_loader(DataLoader(lambda db, keys: Hive.batch_fetch_hive_rows_by_user(db, keys)))
+
     def __init__(self, id: str, index: int, guild_id: int, owner_id: int):
         self.id: str = id
         self.index: int = index
@@ -52,65 +66,13 @@ class Hive(object):
         except ValueError:
             raise commands.BadArgument(f"**{value}** isn't a valid hive name.")
 
-        # Database time
+        # Grab the hive, the bees in it, and its items
         async with ctx.bot.database() as db:
-
-            # Grab the hive and the bees in it
-            hive_rows = await db(
-                """
-                SELECT
-                    h.*, b.id bee_id
-                FROM
-                    hives h
-                LEFT JOIN
-                    bees b
-                ON
-                    h.id = b.hive_id
-                WHERE
-                    index = $1
-                    AND h.guild_id = $2
-                    AND h.owner_id = $3
-                """,
-                hive_index, get_bee_guild_id(ctx), ctx.author.id,
-            )
-            if not hive_rows:
-                raise commands.BadArgument(f"You don't have a hive with the name **{value}**.")
-
-            # Grab the items in the hive
-            inventory_rows = await db(
-                """
-                SELECT
-                    *
-                FROM
-                    hive_inventory
-                WHERE
-                    hive_id = $1
-                """,
-                hive_rows[0]['id'],
-            )
-
-            # Grab the first row so that we can make a hive from it
-            hive_row = dict(hive_rows[0])
-            hive_row.pop("bee_id", None)  # Remove the bee ID so we can just unpack it
-            hive = cls(**hive_row)
-
-            # Parse the inventory items
-            for row in inventory_rows:
-                hive.inventory[row['item_name']] += row['quantity']
-
-            # Grab all the bees that are in the hive
-            bee_ids = [i['bee_id'] for i in hive_rows]
-            bee_rows = await db(
-                """SELECT * FROM bees WHERE id=ANY($1::TEXT[])""",
-                bee_ids,
-            )
-            for row in bee_rows:
-                bee = Bee(**row)
-                bee.hive = hive
-                hive.bees.add(bee)
-
-        # Return the hive object
-        return hive
+            hives = await cls.fetch_hives_by_user(db, get_bee_guild_id(ctx), ctx.author.id)
+        for hive in hives:
+            if hive.index == hive_index:
+                return hive
+        raise commands.BadArgument(f"You don't have a hive with the name **{value}**.")
 
     @classmethod
     async def create_first_hive(cls, db, guild_id: int, user_id: int):
@@ -123,116 +85,207 @@ class Hive(object):
             (GEN_RANDOM_UUID(), 0, $1, $2) RETURNING *""",
             guild_id, user_id,
         )
+        user_cache.invalidate(guild_id, user_id)
         return cls(**rows[0])
 
     @classmethod
-    async def fetch_hives_by_user(
-            cls, db, guild_id: int, user_id: int, *, fetch_bees: bool = True,
-            fetch_inventory: bool = True) -> typing.List['Hive']:
+    async def fetch_hive_rows(
+            cls, db, condition: str, *args, fetch_bees: bool = True,
+            fetch_inventory: bool = True) -> list:
         """
-        Get all the hives for a given user.
+        Get the rows for the hives that match an SQL condition on the hives table (aliased
+        as h), with their bees and inventory aggregated into each row, in a single query.
         """
 
-        # Get hives
-        hive_rows = await db(
-            """SELECT h.*, b.id bee_id FROM hives h LEFT JOIN bees b ON h.id=b.hive_id
-            WHERE h.guild_id=$1 AND h.owner_id=$2""",
-            guild_id, user_id,
-        )
-        hives = {}
-        bee_ids = []
-        if hive_rows:
-            for r in hive_rows:
-                r = dict(r)
-                bee_id = r.pop('bee_id', None)
-                hive = cls(**r)
-                if bee_id:
-                    bee_ids.append(bee_id)
-                hives[hive.id] = hive
-        else:
-            new_hive = await cls.create_first_hive(db, guild_id, user_id)
-            hives[new_hive.id] = new_hive
-
-        # Get bees
+        bee_column = "NULL"
         if fetch_bees:
-            bee_rows = await db(
-                """SELECT * FROM bees WHERE id=ANY($1::TEXT[])""",
-                bee_ids,
+            bee_column = "(SELECT JSON_AGG(b.*) FROM bees b WHERE b.hive_id = h.id)"
+        inventory_column = "NULL"
+        if fetch_inventory:
+            inventory_column = (
+                "(SELECT JSON_OBJECT_AGG(i.item_name, i.quantity) FROM hive_inventory i "
+                "WHERE i.hive_id = h.id)"
             )
-            for r in bee_rows:
-                bee = Bee(**r)
-                hive = hives[bee.hive_id]
-                hive.bees.add(bee)
+        return await db(
+            f"""
+            SELECT
+                h.*,
+                {bee_column} AS bees,
+                {inventory_column} AS inventory
+            FROM
+                hives h
+            WHERE
+                {condition}
+            ORDER BY
+                h.index
+            """,
+            *args,
+        )
+
+    @classmethod
+    def from_rows(cls, rows: list, *, fetch_inventory: bool = True) -> typing.List['Hive']:
+        """
+        Build hives (and their bees and inventory) from rows given by `fetch_hive_rows`.
+        """
+
+        hives = []
+        for row in rows:
+            row = dict(row)
+            bee_data = row.pop('bees')
+            inventory_data = row.pop('inventory')
+            hive = cls(**row)
+            for data in json.loads(bee_data or "[]"):
+                bee = Bee.from_json(data)
                 bee.hive = hive
+                hive.bees.add(bee)
+            if fetch_inventory:
+                for item_name, quantity in json.loads(inventory_data or "{}").items():
+                    hive.inventory[item_name] += quantity
+            hives.append(hive)
+        return hives
 
-        # Get inventory
-        if fetch_inventory:
-            inventory_rows = await db(
-                """SELECT * FROM hive_inventory WHERE hive_id=ANY($1::TEXT[])""",
-                hives.keys(),
+    def add_unsaved_inventory(self):
+        """
+        Add on whatever the tick has made for this hive that hasn't been saved yet. This
+        is only for showing to the user - we can only see the unsaved items if the tick
+        is running in this process, and they'll be in the hive's saved inventory once
+        they're flushed.
+        """
+
+        if not hive_inventory_buffer.live:
+            return
+        for item_name, quantity in hive_inventory_buffer.hives.get(self.id, {}).items():
+            self.inventory[item_name] += quantity
+
+    @classmethod
+    async def fetch_hives(
+            cls, db, condition: str, *args, fetch_bees: bool = True,
+            fetch_inventory: bool = True) -> typing.List['Hive']:
+        """
+        Get the hives that match an SQL condition on the hives table (aliased as h), along
+        with their bees and inventory, in a single query.
+        """
+
+        rows = await cls.fetch_hive_rows(
+            db, condition, *args,
+            fetch_bees=fetch_bees, fetch_inventory=fetch_inventory,
+        )
+        return cls.from_rows(rows, fetch_inventory=fetch_inventory)
+
+    @classmethod
+    async def batch_fetch_hive_rows_by_user(cls, db, keys: typing.List[tuple]) -> typing.Dict[tuple, list]:
+        """
+        Get the hive rows for a batch of (guild ID, user ID, fetch bees, fetch inventory)
+        keys, with one query per guild and set of flags.
+        """
+
+        users_by_query = collections.defaultdict(list)
+        for guild_id, user_id, fetch_bees, fetch_inventory in keys:
+            users_by_query[(guild_id, fetch_bees, fetch_inventory,)].append(user_id)
+        hive_rows = {i: [] for i in keys}
+        for (guild_id, fetch_bees, fetch_inventory), user_ids in users_by_query.items():
+            rows = await cls.fetch_hive_rows(
+                db, "h.guild_id = $1 AND h.owner_id = ANY($2::BIGINT[])", guild_id, user_ids,
+                fetch_bees=fetch_bees, fetch_inventory=fetch_inventory,
             )
-            for r in inventory_rows:
-                hive = hives[r['hive_id']]
-                hive.inventory[r['item_name']] += r['quantity']
+            for row in rows:
+                hive_rows[(guild_id, row['owner_id'], fetch_bees, fetch_inventory,)].append(row)
+        return hive_rows
 
-        # And return the hives
-        return hives.values()
+    @classmethod
+    async def fetch_hives_by_user(
+            cls, db, guild_id: int, user_id: int, *, fetch_bees: bool = True,
+            fetch_inventory: bool = True) -> typing.List['Hive']:
+        """
+        Get all the hives for a given user.
+        """
+
+        # See if we have their hives cached already - anyone in a transaction needs to
+        # see their own writes, so they skip the cache
+        key = (guild_id, user_id,)
+        cacheable = not in_transaction(db)
+        cached = (user_cache.hives.get(key) if cacheable else None) or {}
+        rows = cached.get((fetch_bees, fetch_inventory,))
+
+        # Grab them from the database if not
+        if rows is None:
+            version = user_cache.invalidations
+            rows = await cls.user_loader.load(db, (guild_id, user_id, fetch_bees, fetch_inventory,))
+            if not rows:
+                await cls.create_first_hive(db, guild_id, user_id)
+                return await cls.fetch_hives_by_user(
+                    db, guild_id, user_id,
+                    fetch_bees=fetch_bees, fetch_inventory=fetch_inventory,
+                )
+            if cacheable:
+                user_cache.set(user_cache.hives, key, {**cached, (fetch_bees, fetch_inventory,): rows}, version)
+        return cls.from_rows(rows, fetch_inventory=fetch_inventory)
 
     @classmethod
     async def fetch_hive_by_id(
             cls, db, hive_id: str, *, fetch_bees: bool = True,
             fetch_inventory: bool = True) -> typing.Optional['Hive']:
         """
-        Get all the hives for a given user.
+        Get a hive by its ID.
         """
 
-        # Get hives
-        hive_rows = await db(
-            """SELECT h.*, b.id bee_id FROM hives h LEFT JOIN bees b ON h.id = b.hive_id
-            WHERE h.id = $1""",
-            hive_id,
+        hives = await cls.fetch_hives(
+            db, "h.id = $1", hive_id,
+            fetch_bees=fetch_bees, fetch_inventory=fetch_inventory,
         )
-        hives = {}
-        bee_ids = []
-        if hive_rows:
-            for r in hive_rows:
-                r = dict(r)
-                bee_id = r.pop('bee_id', None)
-                hive = cls(**r)
-                if bee_id:
-                    bee_ids.append(bee_id)
-                hives[hive.id] = hive
-        else:
+        if not hives:
             return None
+        return hives[0]
 
-        # Get bees
-        if fetch_bees:
-            bee_rows = await db(
-                """SELECT * FROM bees WHERE id=ANY($1::TEXT[])""",
-                bee_ids,
-            )
-            for r in bee_rows:
-                bee = Bee(**r)
-                hive = hives[bee.hive_id]
-                hive.bees.add(bee)
-                bee.hive = hive
+    def get_hive_grid(self, width: int = 9, height: int = 9):
+        key = (self.id, width, height,)
+        grid = self.grid_cache.get(key)
+        if grid is None:
+            r = random.Random(uuid.UUID(self.id).int % 100_000_000)
+            grid = HiveCellEmoji.get_grid(width, height, random=r)
+            self.grid_cache.set(key, grid)
+        return grid
 
-        # Get inventory
-        if fetch_inventory:
-            inventory_rows = await db(
-                """SELECT * FROM hive_inventory WHERE hive_id=ANY($1::TEXT[])""",
-                hives.keys(),
-            )
-            for r in inventory_rows:
-                hive = hives[r['hive_id']]
-                hive.inventory[r['item_name']] += r['quantity']
+    @classmethod
+    def load_grid_cache(cls, filename: str):
+        """
+        Load the saved hive grids from a file, if there is one. If the file can't be read
+        (eg it's been left half written) then we just start with an empty cache.
+        """
 
-        # And return the hives
-        return list(hives.values())[0]
+        try:
+            with open(filename, encoding="utf-8") as a:
+                data = json.load(a)
+            items = [((hive_id, width, height,), grid) for hive_id, width, height, grid in data]
+        except (OSError, ValueError, TypeError):
+            return
+        for key, grid in items:
+            cls.grid_cache.set(key, grid)
 
-    def get_hive_grid(self, width: int = 9, height: int = 9):
-        r = random.Random(uuid.UUID(self.id).int % 100_000_000)
-        return HiveCellEmoji.get_grid(width, height, random=r)
+    @classmethod
+    def save_grid_cache(cls, filename: str, items: typing.List[tuple] = None):
+        """
+        Save the cached hive grids to a file, so that they're still cached after a restart.
+        The items to save can be given if they've already been taken out of the cache.
+        """
+
+        if items is None:
+            items = cls.grid_cache.items()
+        data = [[*key, grid] for key, grid in items]
+
+        # Write to a temp file of our own and swap it in, so that two saves running at
+        # once can't write over each other's half-written files
+        with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=os.path.dirname(filename) or ".",
+                prefix=f"{os.path.basename(filename)}.", suffix=".tmp", delete=False) as a:
+            temp_filename = a.name
+            try:
+                json.dump(data, a)
+            except Exception:
+                a.close()
+                os.remove(temp_filename)
+                raise
+        os.replace(temp_filename, filename)
 
     @classmethod
     async def send_hive_dropdown(
@@ -1,22 +1,87 @@
+import bisect
+import itertools
 import operator
 import random as random_module
 
 
 class HiveCellEmoji(object):
 
+    HAS_TOP = 1
+    HAS_LEFT = 2
+    HAS_RIGHT = 4
+    HAS_BOTTOM = 8
+    HAS_MIDDLE = 16
+    FLAG_BITS = {
+        "HAS_TOP": HAS_TOP,
+        "HAS_LEFT": HAS_LEFT,
+        "HAS_RIGHT": HAS_RIGHT,
+        "HAS_BOTTOM": HAS_BOTTOM,
+        "HAS_MIDDLE": HAS_MIDDLE,
+    }
+
     all_cells = set()
 
+    #: The valid cells and their cumulative weights for each pair of required and
+    #: forbidden flags, indexed by ``required | forbidden << 5``. Built when it's needed.
+    cell_table = None
+
     def __init__(self, emoji, flags, weight: int = 100):
         self.emoji = emoji
         self.flags = flags
+        self.mask = self.get_mask(flags)
         self.weight = weight
         self.all_cells.add(self)
+        HiveCellEmoji.cell_table = None
+
+    @classmethod
+    def get_mask(cls, flags) -> int:
+        """
+        Turn a list of flags into a bitmask.
+        """
+
+        mask = 0
+        for i in flags:
+            mask |= cls.FLAG_BITS[i]
+        return mask
+
+    @classmethod
+    def build_cell_table(cls):
+        """
+        Work out the valid cells for every combination of required and forbidden flags.
+        The cells are kept in the same order that they'd be sorted into by weight, so that
+        picking from them uses the random generator in exactly the same way.
+        """
+
+        cells = sorted(cls.all_cells, key=operator.attrgetter("weight"))
+        all_flags = sum(cls.FLAG_BITS.values())
+        table = [None] * ((all_flags + 1) << 5)
+        for required in range(all_flags + 1):
+            for forbidden in range(all_flags + 1):
+                if required & forbidden:
+                    continue
+                valid_cells = [i for i in cells if i.mask & required == required and not i.mask & forbidden]
+                cumulative_weights = list(itertools.accumulate(i.weight for i in valid_cells))
+                table[required | forbidden << 5] = (valid_cells, cumulative_weights,)
+        cls.cell_table = table
+
+    @classmethod
+    def pick_cell(cls, required: int, forbidden: int, *, random: random_module.Random = None):
+        """
+        Pick a random cell that has all of the required flags and none of the forbidden ones,
+        weighted by the cells' weights. This is the same as ``random.choices``, without having
+        to work out the cumulative weights again for every cell.
+        """
+
+        if cls.cell_table is None:
+            cls.build_cell_table()
+        valid_cells, cumulative_weights = cls.cell_table[required | forbidden << 5]
+        total = cumulative_weights[-1] + 0.0
+        index = bisect.bisect(cumulative_weights, (random or random_module).random() * total, 0, len(valid_cells) - 1)
+        return valid_cells[index]
 
     @classmethod
     def get_cell(cls, flags, noflags, *, random: random_module.Random = None):
-        valid_cells = [i for i in cls.all_cells if set(i.flags).issuperset(set(flags)) and not set(i.flags).intersection(set(noflags))]
-        valid_cells.sort(key=operator.attrgetter("weight"))
-        return (random or random_module).choices(valid_cells, weights=[i.weight for i in valid_cells], k=1)[0]
+        return cls.pick_cell(cls.get_mask(flags), cls.get_mask(noflags), random=random)
 
     @classmethod
     def get_grid(cls, width: int = 9, height: int = 9, *, random: random_module.Random = None):
@@ -32,38 +97,35 @@ class HiveCellEmoji(object):
             for x in range(0, width):
 
                 # Set up our filters
-                search_cells = set()
-                nosearch_cells = set()
+                required = 0
+                forbidden = 0
 
                 # See if there's a cell above
                 if y:
-                    above = grid[y - 1][x]
-                    if "HAS_BOTTOM" in above.flags:
-                        search_cells.add("HAS_TOP")
+                    if grid[y - 1][x].mask & cls.HAS_BOTTOM:
+                        required |= cls.HAS_TOP
                     else:
-                        nosearch_cells.add("HAS_TOP")
+                        forbidden |= cls.HAS_TOP
 
                 # See if there's a cell to the left
                 if x:
-                    left = grid[y][x - 1]
-                    if "HAS_RIGHT" in left.flags:
-                        search_cells.add("HAS_LEFT")
+                    if grid[y][x - 1].mask & cls.HAS_RIGHT:
+                        required |= cls.HAS_LEFT
                     else:
-                        nosearch_cells.add("HAS_LEFT")
+                        forbidden |= cls.HAS_LEFT
 
                 # See if we're EDGING BABY
                 if x == 0:
-                    nosearch_cells.add("HAS_LEFT")
+                    forbidden |= cls.HAS_LEFT
                 if x == width - 1:
-                    nosearch_cells.add("HAS_RIGHT")
+                    forbidden |= cls.HAS_RIGHT
                 if y == 0:
-                    nosearch_cells.add("HAS_TOP")
+                    forbidden |= cls.HAS_TOP
                 if y == height - 1:
-                    nosearch_cells.add("HAS_BOTTOM")
+                    forbidden |= cls.HAS_BOTTOM
 
                 # Find a relevant cell
-                new_cell = cls.get_cell(search_cells, nosearch_cells, random=random)
-                grid[y][x] = new_cell
+                grid[y][x] = cls.pick_cell(required, forbidden, random=random)
 
         # Join and return
         output_lines = list()
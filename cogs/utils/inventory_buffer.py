@@ -0,0 +1,90 @@
+import collections
+import typing
+
+
+class InventoryBuffer(object):
+    """
+    Collects changes to hive inventories in memory so that they can be written to the
+    database in one batch, rather than one upsert per change.
+    """
+
+    def __init__(self):
+        self.hives: typing.Dict[str, typing.Counter[str]] = collections.defaultdict(collections.Counter)
+        self.live: bool = False  # Whether a tick engine in this process is filling the buffer
+
+    def __len__(self):
+        return sum(len(i) for i in self.hives.values())
+
+    def add(self, hive_id: str, item_name: str, quantity: int = 1):
+        """
+        Add some items to a hive's inventory.
+        """
+
+        self.hives[hive_id][item_name] += quantity
+
+    def clear(self):
+        """
+        Throw away all of the buffered changes.
+        """
+
+        self.hives.clear()
+
+    def discard_hive(self, hive_id: str):
+        """
+        Throw away the buffered changes for a single hive, eg when it's been emptied.
+        """
+
+        self.hives.pop(hive_id, None)
+
+    def take(self) -> typing.List[typing.Tuple[str, str, int]]:
+        """
+        Take all of the buffered changes out of the buffer, as (hive ID, item name, quantity)
+        tuples, so that they can be written to the database.
+        """
+
+        hives, self.hives = self.hives, collections.defaultdict(collections.Counter)
+        return [
+            (hive_id, item_name, quantity,)
+            for hive_id, items in hives.items()
+            for item_name, quantity in items.items()
+            if quantity
+        ]
+
+    def restore(self, changes: typing.List[typing.Tuple[str, str, int]]):
+        """
+        Put some changes that were taken out of the buffer back in, as they couldn't be saved.
+        """
+
+        for change in changes:
+            self.add(*change)
+
+    @staticmethod
+    async def write(db, changes: typing.List[typing.Tuple[str, str, int]]):
+        """
+        Add a list of (hive ID, item name, quantity) changes to the hive inventories in the
+        database. This should be run in the same transaction as whatever records that the
+        changes have been made, so that they're never saved (or lost) twice.
+        """
+
+        if not changes:
+            return
+        await db(
+            """
+            INSERT INTO
+                hive_inventory
+                (hive_id, item_name, quantity)
+            SELECT
+                *
+            FROM
+                UNNEST($1::TEXT[], $2::TEXT[], $3::INTEGER[])
+            ON CONFLICT
+                (hive_id, item_name)
+            DO UPDATE SET
+                quantity = hive_inventory.quantity + excluded.quantity
+            """,
+            [i[0] for i in changes], [i[1] for i in changes], [i[2] for i in changes],
+        )
+
+
+#: The changes to hive inventories that are waiting to be saved.
+hive_inventory_buffer = InventoryBuffer()
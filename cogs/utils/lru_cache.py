@@ -0,0 +1,99 @@
+import collections
+import time
+import typing
+
+
+class LRUCache(object):
+    """
+    A mapping that holds a limited number of items, throwing out the least recently
+    used ones once it's full, and optionally forgetting items after a number of seconds.
+    Hits and misses are counted so we can see how useful the cache is being.
+    """
+
+    def __init__(self, max_size: int = 1_000, *, ttl: typing.Optional[float] = None):
+        self.max_size: int = max_size
+        self.ttl: typing.Optional[float] = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._items: collections.OrderedDict = collections.OrderedDict()  # Key to (expiry time, value)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        try:
+            expires_at, _ = self._items[key]
+        except KeyError:
+            return False
+        return expires_at is None or expires_at > time.monotonic()
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of lookups that have been found in the cache.
+        """
+
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+    def get(self, key, default=None):
+        """
+        Get an item from the cache, marking it as recently used.
+        """
+
+        try:
+            expires_at, value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Add an item to the cache, throwing out the oldest items if we're over our size.
+        """
+
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = time.monotonic() + self.ttl
+        self._items[key] = (expires_at, value,)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def items(self) -> typing.List[tuple]:
+        """
+        Get the (key, value) pairs that are in the cache, from least to most recently used.
+        """
+
+        now = time.monotonic()
+        return [
+            (key, value,)
+            for key, (expires_at, value) in self._items.items()
+            if expires_at is None or expires_at > now
+        ]
+
+    def pop(self, key, default=None):
+        """
+        Remove an item from the cache.
+        """
+
+        try:
+            return self._items.pop(key)[1]
+        except KeyError:
+            return default
+
+    def clear(self):
+        """
+        Remove everything from the cache.
+        """
+
+        self._items.clear()
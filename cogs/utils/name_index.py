@@ -0,0 +1,33 @@
+import bisect
+import typing
+
+
+class NameIndex(object):
+    """
+    The names of everything that a single user owns, mapped to their IDs. Names are
+    kept sorted (ignoring case, as the database does) so that we can look them up
+    without going through every one of them.
+    """
+
+    __slots__ = ('names', 'ids',)
+
+    def __init__(self, items: typing.Iterable[typing.Tuple[str, str]] = ()):
+        self.names: typing.List[str] = []  # The lowercase names, sorted
+        self.ids: typing.List[str] = []  # The ID for each of the names above
+        for id, name in sorted(items, key=lambda i: i[1].lower()):
+            self.names.append(name.lower())
+            self.ids.append(id)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name: str) -> typing.Optional[str]:
+        """
+        Get the ID for a given name.
+        """
+
+        name = name.lower()
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            return self.ids[index]
+        return None
@@ -0,0 +1,267 @@
+import collections
+import json
+import time
+import typing
+
+import asyncpg
+
+from .bee import Bee, BeeType
+from .inventory_buffer import InventoryBuffer, hive_inventory_buffer
+from .user_cache import user_cache
+from .utils import get_tick, get_hive_partition, parse_json_timestamp
+
+
+class TickStats(object):
+    """
+    A rolling record of how long each phase of the tick has taken, as well as how
+    many ticks have overrun their budget or been skipped altogether.
+    """
+
+    def __init__(self, window: int = 720):
+        self.window: int = window
+        self.runs: int = 0
+        self.overruns: int = 0
+        self.skipped: int = 0
+        self.last_tick: typing.Optional[int] = None
+        self.timings: typing.Dict[str, typing.Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window)
+        )
+
+    def record(self, phase: str, seconds: float):
+        """
+        Add a timing for a given phase.
+        """
+
+        self.timings[phase].append(seconds)
+
+    def get_percentile(self, phase: str, percentile: float) -> typing.Optional[float]:
+        """
+        Get a percentile (from 0 to 100) of the recorded timings for a given phase.
+        """
+
+        timings = sorted(self.timings.get(phase, ()))
+        if not timings:
+            return None
+        index = round((len(timings) - 1) * percentile / 100)
+        return timings[index]
+
+
+class TickEngine(object):
+    """
+    Runs the bee ticks - making combs, killing queens, and queueing up notifications
+    for those deaths. The hives can be split into partitions, with an engine running
+    for each of them.
+    """
+
+    #: The phases of each tick, in the order that they're run.
+    PHASES = ("increment", "production", "deaths",)
+
+    #: How often to write the buffered combs to the database, in seconds.
+    FLUSH_INTERVAL = 30
+
+    def __init__(
+            self, database, *, partition: int = 0, partitions: int = 1,
+            leader_name: str, lease: float, listen_config: typing.Optional[dict] = None):
+        self.database = database
+        self.partition: int = partition
+        self.partitions: int = partitions
+        self.leader_name: str = leader_name  # The tick leader that this engine is running for
+        self.lease: float = lease  # How long the leader can go without renewing before its writes are refused
+        self.listen_config: typing.Optional[dict] = listen_config  # Where to listen for queens moving hives
+        self.listener: typing.Optional[asyncpg.Connection] = None
+        self.hive_changes: typing.Deque[dict] = collections.deque()
+        self.last_tick: typing.Optional[int] = None  # The last tick that was processed
+        self.saved_tick: typing.Optional[int] = None  # The last tick that had its combs saved
+        self.last_flush: float = 0.0
+
+    async def load(self):
+        """
+        Load the queens that are in hives, catching up on any ticks that were missed
+        since the last time that the engine ran.
+        """
+
+        # Start listening before we load so that we don't miss anything that
+        # changes while we do
+        if self.listen_config is not None:
+            config = self.listen_config.copy()
+            config.pop("enabled", None)
+            self.listener = await asyncpg.connect(**config)
+            await self.listener.add_listener("queen_hive_changes", self.handle_hive_change)
+            await self.listener.add_listener("hive_inventory_clears", self.handle_inventory_clear)
+
+        # And load
+        tick = get_tick()
+        async with self.database() as db:
+            await Bee.load_schedules(db, tick, self.partition, self.partitions)
+            await self.flush(db, tick)
+        self.last_tick = tick
+        hive_inventory_buffer.live = True
+
+    async def close(self):
+        """
+        Stop listening for queens moving hives.
+        """
+
+        if self.listener is not None:
+            await self.listener.close()
+            self.listener = None
+
+    async def discard(self):
+        """
+        Throw away anything that the engine has buffered and stop it. This is used
+        when another process has taken over the ticks, and will pick up from the
+        last tick that was saved.
+        """
+
+        hive_inventory_buffer.clear()
+        hive_inventory_buffer.live = False
+        self.hive_changes.clear()
+        self.last_tick = None
+        await self.close()
+
+    def handle_hive_change(self, connection, pid, channel, payload):
+        """
+        Queue up a queen entering or leaving a hive, as sent by the database. These are
+        applied at the start of the next tick.
+        """
+
+        self.hive_changes.append(json.loads(payload))
+
+    def handle_inventory_clear(self, connection, pid, channel, payload):
+        """
+        Throw away the unsaved combs for a hive that's just been emptied, as sent by
+        the database, so that they aren't written back into it on the next flush.
+        """
+
+        hive_inventory_buffer.discard_hive(payload)
+
+    def apply_hive_changes(self):
+        """
+        Update the schedules for any queens that have entered or left a hive since the
+        last tick.
+        """
+
+        while self.hive_changes:
+            change = self.hive_changes.popleft()
+            Bee.cancel_schedules(change['id'])
+            if change['hive_id'] is None or change['hive_expires_at'] is None:
+                continue
+            if get_hive_partition(change['hive_id'], self.partitions) != self.partition:
+                continue
+            Bee.add_schedules(
+                change['id'], change['hive_id'], change['type'], change['speed'],
+                parse_json_timestamp(change['hive_entered_at']),
+                parse_json_timestamp(change['hive_expires_at']),
+            )
+
+    async def flush(self, db, tick: int = None):
+        """
+        Save all of the buffered combs, along with the tick that they've been made up to.
+        """
+
+        tick = tick or self.last_tick
+        changes = hive_inventory_buffer.take()
+        try:
+            await db.start_transaction()
+            await InventoryBuffer.write(db, changes)
+            await db(
+                """SELECT * FROM advance_tick($1, $2::TEXT[], $3, $4, $5)""",
+                tick, [], self.partition, self.leader_name, self.lease,
+            )
+            await db.commit_transaction()
+        except Exception:
+            hive_inventory_buffer.restore(changes)
+            raise
+        self.saved_tick = tick
+        self.last_flush = time.monotonic()
+
+    async def save(self):
+        """
+        Save anything that the engine has buffered.
+        """
+
+        if self.last_tick is None:
+            return
+        async with self.database() as db:
+            await self.flush(db)
+
+    async def run(self, tick: int = None) -> dict:
+        """
+        Process every tick up to the given one, giving back a summary of what
+        happened and how long each phase took.
+        """
+
+        # Never move backwards, even if the clock does
+        tick = max(tick or get_tick(), self.last_tick or 0)
+        timings = {}
+        dead_queens = {}
+
+        # See which queens have made combs and which have died since the last tick - this
+        # may be more than one tick ago if the last one overran or the ticker is set to
+        # run less often
+        start = time.perf_counter()
+        self.apply_hive_changes()
+        productions = Bee.advance_production(tick)
+        dying_queens = Bee.death_wheel.advance(tick)
+        timings["increment"] = time.perf_counter() - start
+
+        # If anything goes wrong from here then the dying queens go back on the wheel, to
+        # be tried again on the next run
+        try:
+
+            # Add the queens' combs to the buffer, saving them every so often
+            start = time.perf_counter()
+            for hive_id, bee_type, quantity in productions:
+                hive_inventory_buffer.add(hive_id, BeeType.get(bee_type).get_comb_name(), quantity)
+            flush_due = time.monotonic() - self.last_flush >= self.FLUSH_INTERVAL
+            if flush_due:
+                async with self.database() as db:
+                    await self.flush(db, tick)
+            timings["production"] = time.perf_counter() - start
+
+            # See which of the queens are dead and handle those heckos - their owners are
+            # told about it by the notification handler. This is all one transaction so that
+            # a hive is never left with neither its queen nor her princess and drones.
+            start = time.perf_counter()
+            if dying_queens:
+                async with self.database() as db:
+                    await db.start_transaction()
+                    dead_queen_rows = await db(
+                        """SELECT * FROM advance_tick($1, $2::TEXT[], $3, $4, $5)""",
+                        self.saved_tick, [i for i, _ in dying_queens], self.partition,
+                        self.leader_name, self.lease,
+                    )
+
+                    # The database gives back the queens that are still in their hives; any
+                    # of those that aren't due to die yet (eg their expiry was pushed back)
+                    # go back on the wheel for when they are
+                    dead_queen_list = []
+                    for row in dead_queen_rows:
+                        queen = Bee(**row)
+                        death_tick = get_tick(queen.hive_expires_at, round_up=True)
+                        if death_tick <= tick:
+                            dead_queen_list.append(queen)
+                        else:
+                            Bee.death_wheel.schedule(queen.id, death_tick, queen.hive_id)
+                    dead_queens = {i.hive_id: i for i in dead_queen_list}
+                    owners = {(i.guild_id, i.owner_id,) for i in dead_queen_list}
+                    await Bee.die_many(db, dead_queen_list, transaction=False)
+                    await db.commit_transaction()
+                for guild_id, user_id in owners:
+                    user_cache.invalidate(guild_id, user_id)
+            timings["deaths"] = time.perf_counter() - start
+        except Exception:
+            for bee_id, hive_id in dying_queens:
+                if bee_id not in Bee.death_wheel:
+                    Bee.death_wheel.schedule(bee_id, tick, hive_id)
+            raise
+
+        # And done
+        self.last_tick = tick
+        return {
+            "tick": tick,
+            "productions": len(productions),
+            "deaths": len(dead_queens),
+            "dead_queen_ids": [i.id for i in dead_queens.values()],
+            "timings": timings,
+        }
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import typing
+
+import asyncpg
+
+
+class TickLeader(object):
+    """
+    Elects one process out of any that are connected to the same database to run the
+    ticks, using a Postgres advisory lock held on a connection of its own. The lock is
+    released when that connection closes, so if the leader goes away then one of the
+    standby processes picks it up on its next attempt.
+    """
+
+    #: The keepalive settings for the lock connection, in seconds (apart from the count).
+    KEEPALIVE_IDLE = 5
+    KEEPALIVE_INTERVAL = 2
+    KEEPALIVE_COUNT = 3
+
+    #: How long the database can take to notice that the lock connection has died.
+    KEEPALIVE_DETECTION = KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT
+
+    def __init__(
+            self, database_config: dict, *, lock_id: int, lease: float = 20.0,
+            tick_interval: float = 5.0, retry_interval: float = 1.0, name: str = None,
+            logger: logging.Logger = None):
+        self.database_config: dict = database_config
+        self.lock_id: int = lock_id
+        self.retry_interval: float = retry_interval  # How often to try for the lock, or renew it
+        self.name: str = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.logger: logging.Logger = logger or logging.getLogger("cogs.utils.tick_leader")
+
+        # The lease has to outlast the database noticing that we're gone plus a tick
+        # that was already running, or we could be refused writes that we're still
+        # allowed to make
+        min_lease = self.KEEPALIVE_DETECTION + tick_interval
+        if lease <= min_lease:
+            self.logger.warning(
+                f"Tick leader lease of {lease}s is too short to outlast dead connection "
+                f"detection ({self.KEEPALIVE_DETECTION}s) and a tick ({tick_interval}s) - "
+                f"using {min_lease + retry_interval}s instead"
+            )
+            lease = min_lease + retry_interval
+        self.lease: float = lease  # How long we can go without renewing before we step down
+        self.connection: typing.Optional[asyncpg.Connection] = None
+        self.elected = asyncio.Event()
+
+        # Metrics
+        self.elections: int = 0
+        self.demotions: int = 0
+        self.renewal_failures: int = 0
+        self.leader_since: typing.Optional[float] = None
+        self.last_renewed: typing.Optional[float] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """
+        Whether this process holds the lock and has renewed it within the lease.
+        """
+
+        if not self.elected.is_set() or self.last_renewed is None:
+            return False
+        return time.monotonic() - self.last_renewed < self.lease
+
+    async def connect(self):
+        """
+        Open the connection that the lock is held on. Keepalives are kept short so that
+        the database notices quickly if we vanish, letting a standby take over.
+        """
+
+        config = self.database_config.copy()
+        config.pop("enabled", None)
+        self.connection = await asyncpg.connect(
+            **config,
+            server_settings={
+                "application_name": f"tick-leader {self.name}",
+                "tcp_keepalives_idle": str(self.KEEPALIVE_IDLE),
+                "tcp_keepalives_interval": str(self.KEEPALIVE_INTERVAL),
+                "tcp_keepalives_count": str(self.KEEPALIVE_COUNT),
+            },
+        )
+
+    async def try_acquire(self) -> bool:
+        """
+        Try to take the lock, recording ourselves as the leader if we get it.
+        """
+
+        acquired = await self.connection.fetchval("""SELECT pg_try_advisory_lock($1)""", self.lock_id)
+        if not acquired:
+            return False
+        await self.connection.execute(
+            """
+            INSERT INTO
+                tick_leader
+                (id, process_name, elected_at, renewed_at)
+            VALUES
+                (TRUE, $1, TIMEZONE('UTC', NOW()), TIMEZONE('UTC', NOW()))
+            ON CONFLICT
+                (id)
+            DO UPDATE SET
+                process_name = excluded.process_name,
+                elected_at = excluded.elected_at,
+                renewed_at = excluded.renewed_at
+            """,
+            self.name,
+        )
+        return True
+
+    async def renew(self) -> bool:
+        """
+        Confirm that we still hold the lock, bumping our lease in the database.
+        """
+
+        renewed = await self.connection.fetchval(
+            """
+            UPDATE
+                tick_leader
+            SET
+                renewed_at = TIMEZONE('UTC', NOW())
+            WHERE
+                process_name = $1
+                AND EXISTS (
+                    SELECT
+                        1
+                    FROM
+                        pg_locks
+                    WHERE
+                        locktype = 'advisory'
+                        AND classid = ($2::BIGINT >> 32)::OID
+                        AND objid = ($2::BIGINT & 4294967295)::OID
+                        AND objsubid = 1
+                        AND pid = pg_backend_pid()
+                        AND granted
+                )
+            RETURNING
+                TRUE
+            """,
+            self.name, self.lock_id,
+        )
+        return bool(renewed)
+
+    def step_up(self):
+        """
+        Start being the leader.
+        """
+
+        self.elections += 1
+        self.leader_since = time.monotonic()
+        self.last_renewed = time.monotonic()
+        self.elected.set()
+        self.logger.info(f"{self.name} is now the tick leader")
+
+    async def step_down(self):
+        """
+        Stop being the leader, dropping our connection so that the lock is definitely
+        released for whoever takes over.
+        """
+
+        if self.elected.is_set():
+            self.demotions += 1
+            self.logger.warning(f"{self.name} is no longer the tick leader")
+        self.elected.clear()
+        self.leader_since = None
+        self.last_renewed = None
+        await self.disconnect()
+
+    async def disconnect(self):
+        """
+        Close the lock connection, killing it if it won't close cleanly.
+        """
+
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        try:
+            await asyncio.wait_for(connection.close(), timeout=self.retry_interval)
+        except Exception:
+            connection.terminate()
+
+    async def run(self):
+        """
+        Keep trying for the lock until we get it, and then keep renewing it until we
+        lose it - forever.
+        """
+
+        while True:
+            try:
+                if self.connection is None or self.connection.is_closed():
+                    await self.step_down()
+                    await self.connect()
+                if self.elected.is_set():
+                    renewed = await asyncio.wait_for(self.renew(), timeout=self.lease)
+                    if renewed:
+                        self.last_renewed = time.monotonic()
+                    else:
+                        await self.step_down()
+                elif await asyncio.wait_for(self.try_acquire(), timeout=self.lease):
+                    self.step_up()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.renewal_failures += 1
+                self.logger.error("Error checking the tick lock", exc_info=e)
+                if not self.is_leader:
+                    await self.step_down()
+            await asyncio.sleep(self.retry_interval)
+
+    async def wait_until_leader(self):
+        """
+        Wait until this process becomes the leader.
+        """
+
+        await self.elected.wait()
+
+    async def close(self):
+        """
+        Give up the lock.
+        """
+
+        await self.step_down()
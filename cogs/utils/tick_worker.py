@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import voxelbotutils as vbu
+
+from .tick_engine import TickEngine
+from .utils import get_tick
+
+
+# The engine and event loop for the partition that this worker process runs
+_engine: typing.Optional[TickEngine] = None
+_loop: typing.Optional[asyncio.AbstractEventLoop] = None
+
+
+def start_worker(database_config: dict, partition: int, partitions: int, leader_name: str, lease: float):
+    """
+    Set up a worker process with its own database pool and tick engine.
+    """
+
+    global _engine, _loop
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _loop.run_until_complete(vbu.DatabaseConnection.create_pool(database_config))
+    _engine = TickEngine(
+        vbu.DatabaseConnection, partition=partition, partitions=partitions,
+        leader_name=leader_name, lease=lease, listen_config=database_config,
+    )
+
+
+def load_worker() -> int:
+    """
+    Load the queens for the worker's partition.
+    """
+
+    _loop.run_until_complete(_engine.load())
+    return _engine.last_tick
+
+
+def run_worker_tick(tick: int) -> dict:
+    """
+    Run the worker's partition up to the given tick.
+    """
+
+    return _loop.run_until_complete(_engine.run(tick))
+
+
+def save_worker():
+    """
+    Save anything that the worker has buffered.
+    """
+
+    _loop.run_until_complete(_engine.save())
+
+
+class TickWorkerPool(object):
+    """
+    Runs the bee ticks across a number of worker processes, each handling a
+    partition of the hives. This has the same interface as a tick engine.
+    """
+
+    #: The phases of each tick, in the order that they're run.
+    PHASES = TickEngine.PHASES
+
+    def __init__(self, database_config: dict, partitions: int, *, leader_name: str, lease: float):
+        self.database_config: dict = database_config
+        self.partitions: int = partitions
+        self.leader_name: str = leader_name
+        self.lease: float = lease
+        self.executors: typing.List[ProcessPoolExecutor] = []
+        self.last_tick: typing.Optional[int] = None
+
+    async def run_on_workers(self, func, *args) -> list:
+        """
+        Run a function on every one of the workers, giving back their results in
+        partition order.
+        """
+
+        loop = asyncio.get_event_loop()
+        return await asyncio.gather(*[
+            loop.run_in_executor(executor, func, *args)
+            for executor in self.executors
+        ])
+
+    async def load(self):
+        """
+        Start the worker processes and have them load their queens.
+        """
+
+        # Each worker gets a pool of its own so that it always runs the same partition;
+        # we spawn rather than fork so they don't inherit the bot's event loop
+        context = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1, mp_context=context,
+                initializer=start_worker, initargs=(self.database_config, i, self.partitions, self.leader_name, self.lease),
+            )
+            for i in range(self.partitions)
+        ]
+        loaded_ticks = await self.run_on_workers(load_worker)
+        self.last_tick = max(loaded_ticks)
+
+    async def run(self, tick: int = None) -> dict:
+        """
+        Run every partition up to the given tick, merging their results. The partitions
+        run at the same time, so each phase takes as long as its slowest partition.
+        """
+
+        tick = max(tick or get_tick(), self.last_tick or 0)
+        results = await self.run_on_workers(run_worker_tick, tick)
+        timings = collections.defaultdict(float)
+        for result in results:
+            for phase, seconds in result["timings"].items():
+                timings[phase] = max(timings[phase], seconds)
+        self.last_tick = tick
+        return {
+            "tick": tick,
+            "productions": sum(i["productions"] for i in results),
+            "deaths": sum(i["deaths"] for i in results),
+            "dead_queen_ids": [o for i in results for o in i["dead_queen_ids"]],
+            "timings": dict(timings),
+        }
+
+    async def save(self):
+        """
+        Save anything that the workers have buffered.
+        """
+
+        if self.last_tick is None:
+            return
+        await self.run_on_workers(save_worker)
+
+    async def discard(self):
+        """
+        Stop the workers without saving anything that they've buffered.
+        """
+
+        self.last_tick = None
+        await self.close()
+
+    async def close(self):
+        """
+        Stop all of the worker processes.
+        """
+
+        for executor in self.executors:
+            executor.shutdown(wait=False)
+        self.executors.clear()
@@ -0,0 +1,147 @@
+import typing
+
+
+class TimerWheel(object):
+    """
+    A hierarchical timer wheel, mapping keys to the tick that they're due on.
+
+    Each level of the wheel has a number of slots, with every slot on a level
+    covering `slots` times as many ticks as a slot on the level below it.
+    Timers are dropped into the lowest level that covers their tick, and are
+    cascaded down a level as the wheel turns past them. Advancing the wheel
+    only ever touches the slots that the current tick lands on, so ticks with
+    nothing due cost next to nothing.
+    """
+
+    __slots__ = ('slots', 'levels', 'current_tick', '_wheels', '_overflow', '_due', '_timers',)
+
+    def __init__(self, current_tick: int = 0, *, slots: int = 64, levels: int = 3):
+        self.slots: int = slots
+        self.levels: int = levels
+        self.current_tick: int = current_tick
+        self._wheels: typing.List[typing.List[dict]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._overflow: dict = {}  # Timers past the end of the top level
+        self._due: dict = {}  # Timers that were scheduled for a tick that's already passed
+        self._timers: typing.Dict[typing.Hashable, dict] = {}  # Key to the bucket that it's stored in
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _get_bucket(self, tick: int) -> dict:
+        """
+        Get the bucket that a timer for the given tick should be stored in.
+        """
+
+        if tick <= self.current_tick:
+            return self._due
+        for level in range(self.levels):
+            span = self.slots ** (level + 1)
+            if tick // span == self.current_tick // span:
+                return self._wheels[level][(tick // (self.slots ** level)) % self.slots]
+        return self._overflow
+
+    def _store(self, key, tick: int, value):
+        bucket = self._get_bucket(tick)
+        bucket[key] = (tick, value,)
+        self._timers[key] = bucket
+
+    def _cascade(self, bucket: dict):
+        items = list(bucket.items())
+        bucket.clear()
+        for key, (tick, value) in items:
+            self._store(key, tick, value)
+
+    def _expire(self, bucket: dict, expired: list):
+        for key, (_, value) in bucket.items():
+            del self._timers[key]
+            expired.append((key, value,))
+        bucket.clear()
+
+    def get(self, key) -> typing.Optional[int]:
+        """
+        Get the tick that a given key is due on.
+        """
+
+        try:
+            return self._timers[key][key][0]
+        except KeyError:
+            return None
+
+    def schedule(self, key, tick: int, value=None):
+        """
+        Schedule a key to be due on a given tick, replacing any timer that was
+        already set for it.
+        """
+
+        self.cancel(key)
+        self._store(key, tick, value)
+
+    def cancel(self, key):
+        """
+        Remove a key from the wheel, returning the value that was stored with it.
+        """
+
+        bucket = self._timers.pop(key, None)
+        if bucket is None:
+            return None
+        return bucket.pop(key)[1]
+
+    def reset(self, current_tick: int):
+        """
+        Remove every timer from the wheel and move it to the given tick.
+        """
+
+        for level in self._wheels:
+            for bucket in level:
+                bucket.clear()
+        self._overflow.clear()
+        self._due.clear()
+        self._timers.clear()
+        self.current_tick = current_tick
+
+    def advance(self, tick: int) -> typing.List[typing.Tuple[typing.Hashable, typing.Any]]:
+        """
+        Turn the wheel up to the given tick, giving back the `(key, value)` pairs
+        for every timer that's become due.
+        """
+
+        expired = []
+        self._expire(self._due, expired)
+
+        # If we're jumping further than we have timers then it's cheaper to
+        # just sort them all out again than it is to turn the wheel
+        if tick - self.current_tick > len(self._timers):
+            timers = [(key, bucket[key],) for key, bucket in self._timers.items()]
+            self.reset(tick)
+            for key, (due_tick, value) in timers:
+                if due_tick <= tick:
+                    expired.append((key, value,))
+                else:
+                    self._store(key, due_tick, value)
+            return expired
+
+        # Otherwise turn the wheel tick by tick
+        while self.current_tick < tick:
+
+            # There's no point turning an empty wheel
+            if not self._timers:
+                self.current_tick = tick
+                break
+
+            # Cascade anything from the upper levels that's now in range
+            self.current_tick += 1
+            now = self.current_tick
+            if now % (self.slots ** self.levels) == 0:
+                self._cascade(self._overflow)
+            for level in range(self.levels - 1, 0, -1):
+                granularity = self.slots ** level
+                if now % granularity == 0:
+                    self._cascade(self._wheels[level][(now // granularity) % self.slots])
+
+            # And expire what's due
+            self._expire(self._wheels[0][now % self.slots], expired)
+            self._expire(self._due, expired)
+        return expired
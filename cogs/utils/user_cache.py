@@ -0,0 +1,105 @@
+import typing
+
+from .data_loader import DataLoader
+from .lru_cache import LRUCache
+
+
+class UserCache(object):
+    """
+    Keeps the rows for the bees and hives that each user owns (and an index of their
+    bees' names) in memory, keyed by (guild ID, user ID). Anything that writes to a
+    user's bees or hives invalidates their entry; the database also tells us about
+    writes made by other processes.
+    """
+
+    def __init__(self, max_size: int = 5_000, ttl: float = 300):
+        self.bees = LRUCache(max_size=max_size, ttl=ttl)
+        self.hives = LRUCache(max_size=max_size, ttl=ttl)
+        self.names = LRUCache(max_size=max_size, ttl=ttl)
+        self.invalidations: int = 0
+        self.loaders: typing.List[DataLoader] = []  # Loaders that should forget their running loads on invalidation
+
+    @property
+    def hits(self) -> int:
+        return self.bees.hits + self.hives.hits + self.names.hits
+
+    @property
+    def misses(self) -> int:
+        return self.bees.misses + self.hives.misses + self.names.misses
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of lookups that have been found in the cache.
+        """
+
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+    def configure(self, max_size: int, ttl: float):
+        """
+        Change the size and TTL of the cache, clearing it.
+        """
+
+        self.bees = LRUCache(max_size=max_size, ttl=ttl)
+        self.hives = LRUCache(max_size=max_size, ttl=ttl)
+        self.names = LRUCache(max_size=max_size, ttl=ttl)
+
+    def add_loader(self, loader: DataLoader) -> DataLoader:
+        """
+        Add a loader that should forget its running loads whenever something is invalidated,
+        so that nobody waits on a load that started before a write.
+        """
+
+        self.loaders.append(loader)
+        return loader
+
+    def set(self, cache: LRUCache, key: tuple, value, version: int):
+        """
+        Add an item to one of the caches, as long as nothing has been invalidated since
+        the given version was taken - otherwise what we fetched could already be stale.
+        """
+
+        if version == self.invalidations:
+            cache.set(key, value)
+
+    def invalidate(self, guild_id: typing.Optional[int], user_id: typing.Optional[int]):
+        """
+        Throw away everything that's cached for a given user.
+        """
+
+        self.invalidations += 1
+        for loader in self.loaders:
+            loader.forget()
+        if user_id is None:
+            return
+        self.bees.pop((guild_id, user_id,))
+        self.hives.pop((guild_id, user_id,))
+        self.names.pop((guild_id, user_id,))
+
+    def clear(self):
+        """
+        Throw away everything that's cached.
+        """
+
+        self.invalidations += 1
+        for loader in self.loaders:
+            loader.forget()
+        self.bees.clear()
+        self.hives.clear()
+        self.names.clear()
+
+    def handle_owner_change(self, connection, pid, channel, payload):
+        """
+        Invalidate a user's entry when the database tells us that something they
+        own has changed.
+        """
+
+        guild_id, user_id = payload.split(":")
+        self.invalidate(int(guild_id), int(user_id))
+
+
+#: The bees and hives that each user owns.
+user_cache = UserCache()
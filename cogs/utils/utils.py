@@ -1,2 +1,84 @@
+import datetime as dt
+import hashlib
+import math
+import random as random_module
+import typing
+
+
+#: How long a single bee tick lasts for.
+TICK_LENGTH = dt.timedelta(seconds=5)
+
+#: The time that ticks are counted from.
+TICK_EPOCH = dt.datetime(1970, 1, 1)
+
+
 def get_bee_guild_id(ctx):
     return 0
+
+
+def in_transaction(db) -> bool:
+    """
+    Whether a database connection has a transaction open on it.
+    """
+
+    return db.conn.is_in_transaction()
+
+
+def get_hive_partition(hive_id: str, partitions: int) -> int:
+    """
+    Get which of the tick partitions a hive falls into. This needs to stay in line
+    with the hive_partition function in the database.
+    """
+
+    return int(hashlib.md5(hive_id.encode()).hexdigest()[:8], 16) % partitions
+
+
+def parse_json_timestamp(value: typing.Optional[str]) -> typing.Optional[dt.datetime]:
+    """
+    Parse a timestamp that's been turned into JSON by the database. Postgres trims
+    trailing zeroes from the fractional seconds, which older Pythons won't parse.
+    """
+
+    if value is None:
+        return None
+    if "." in value:
+        whole, fraction = value.split(".", 1)
+        value = f"{whole}.{fraction[:6]:0<6}"
+    return dt.datetime.fromisoformat(value)
+
+
+def get_tick(when: dt.datetime = None, *, round_up: bool = False) -> int:
+    """
+    Get the number of the tick that a given (UTC) time falls in. Ticks are
+    counted from a fixed epoch so that they line up across restarts.
+    """
+
+    when = when or dt.datetime.utcnow()
+    tick, remainder = divmod(when - TICK_EPOCH, TICK_LENGTH)
+    if round_up and remainder:
+        tick += 1
+    return tick
+
+
+def get_binomial(trials: int, chance: float, *, random: random_module.Random = None) -> int:
+    """
+    Get how many of the given number of trials succeed, where each has the given
+    chance of succeeding. This skips straight between successes (the gaps between
+    them are geometrically distributed), so it takes time proportional to the
+    number of successes rather than the number of trials.
+    """
+
+    random = random or random_module
+    if trials <= 0 or chance <= 0:
+        return 0
+    if chance >= 1:
+        return trials
+    if chance > 0.5:
+        return trials - get_binomial(trials, 1 - chance, random=random)
+    log_miss = math.log(1.0 - chance)
+    successes = 0
+    position = int(math.log(1.0 - random.random()) / log_miss)
+    while position < trials:
+        successes += 1
+        position += 1 + int(math.log(1.0 - random.random()) / log_miss)
+    return successes